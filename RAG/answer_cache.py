@@ -0,0 +1,178 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from RAG.embedding_store import RAG_INDEX_DIR
+from RAG.query_cache import normalize_query, save_npz_atomically
+from RAG.vector_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# 0 отключает кэш ответов
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', 1024))
+# Минимальная косинусная близость вопроса к закэшированному, чтобы отдать готовый ответ
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('ANSWER_CACHE_THRESHOLD', 0.95))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get('ANSWER_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+# Пустой путь отключает сохранение кэша на диск
+ANSWER_CACHE_PATH = os.environ.get('ANSWER_CACHE_PATH', os.path.join(RAG_INDEX_DIR, 'answer_cache.npz'))
+ANSWER_CACHE_SPILL_EVERY = int(os.environ.get('ANSWER_CACHE_SPILL_EVERY', 20))
+
+
+class SemanticAnswerCache:
+    """
+    Кэш готовых ответов графа по смыслу вопроса: ответ отдаётся, если эмбеддинг нового вопроса
+    достаточно близок к эмбеддингу уже отвеченного. Каждая запись помечена версией базы знаний
+    и не используется после её смены. Размер ограничен (LRU), записи живут не дольше TTL.
+    Периодический сброс на диск идёт в фоновом потоке, сохранения выполняются строго по одному.
+    """
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS, path: str = ANSWER_CACHE_PATH,
+                 spill_every: int = ANSWER_CACHE_SPILL_EVERY):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.spill_every = spill_every
+        # (версия базы знаний, нормализованный вопрос) -> (время, эмбеддинг, ответ)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # Матрица эмбеддингов записей для одного умножения на запрос; пересобирается после изменений
+        self._matrix: Optional[np.ndarray] = None
+        self._keys = []
+        self._unsaved = 0
+        self._spill_pending = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled and self.path:
+            self.load()
+            atexit.register(self.save)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _search_matrix(self):
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = (np.stack([entry[1] for entry in self._entries.values()])
+                            if self._entries else np.empty((0, 0), dtype=np.float32))
+        return self._keys, self._matrix
+
+    def get(self, question: str, embedding, kb_version: str) -> Optional[str]:
+        """Ответ на близкий вопрос для той же версии базы знаний или None"""
+        if not self.enabled:
+            return None
+        query = normalize_rows(embedding)
+        with self._lock:
+            keys, matrix = self._search_matrix()
+            best_key, best_score = None, self.threshold
+            if len(keys):
+                scores = matrix @ query
+                now = time.time()
+                for row in np.argsort(-scores):
+                    if scores[row] < self.threshold:
+                        break
+                    key = keys[row]
+                    entry = self._entries.get(key)
+                    if key[0] == kb_version and entry is not None and now - entry[0] <= self.ttl_seconds:
+                        best_key, best_score = key, float(scores[row])
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            logger.info(f"Answer cache hit ({best_score:.3f}) for '{question[:80]}' <- '{best_key[1][:80]}'")
+            return self._entries[best_key][2]
+
+    def put(self, question: str, embedding, kb_version: str, answer: str):
+        """Запоминает ответ; записи других версий базы знаний и самые давние вытесняются"""
+        if not self.enabled:
+            return
+        key = (kb_version, normalize_query(question))
+        with self._lock:
+            for stale in [other for other in self._entries if other[0] != kb_version]:
+                del self._entries[stale]
+                self.evictions += 1
+            self._entries[key] = (time.time(), normalize_rows(embedding), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+            self._unsaved += 1
+            spill = bool(self.path) and self._unsaved >= self.spill_every and not self._spill_pending
+            self._spill_pending = self._spill_pending or spill
+        if spill:
+            # put вызывается из run_graph: np.savez не должен блокировать event loop
+            threading.Thread(target=self.save, name='answer-cache-spill', daemon=True).start()
+
+    def clear(self):
+        """Удаляет все записи"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики для мониторинга"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def save(self):
+        """Сбрасывает живые записи на диск (атомарно)"""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                now = time.time()
+                entries = [(key, entry) for key, entry in self._entries.items()
+                           if now - entry[0] <= self.ttl_seconds]
+                self._unsaved = 0
+                self._spill_pending = False
+            if not entries:
+                return
+            try:
+                save_npz_atomically(
+                    self.path,
+                    versions=np.array([key[0] for key, _ in entries]),
+                    questions=np.array([key[1] for key, _ in entries]),
+                    created=np.array([entry[0] for _, entry in entries]),
+                    vectors=np.stack([entry[1] for _, entry in entries]),
+                    answers=np.array([entry[2] for _, entry in entries]),
+                )
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not persist answer cache: {e}")
+
+    def load(self):
+        """Поднимает сохранённые записи с диска, пропуская просроченные"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                now = time.time()
+                with self._lock:
+                    for version, question, created, vector, answer in zip(
+                            data['versions'], data['questions'], data['created'], data['vectors'], data['answers']):
+                        if now - created <= self.ttl_seconds:
+                            self._entries[(str(version), str(question))] = (float(created), vector, str(answer))
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+                    self._matrix = None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Answer cache at {self.path} is unreadable ({e}), starting empty")
@@ -0,0 +1,87 @@
+import json
+import os
+import struct
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from RAG.embedding_store import RAG_INDEX_DIR
+
+# Версия формата артефакта индекса; артефакты другой версии не загружаются
+ARTIFACT_FORMAT_VERSION = 1
+ARTIFACT_MAGIC = b'ZMRAGIDX'
+# Массивы выравниваются, чтобы memory-map отдавал выровненные данные
+ARTIFACT_ALIGNMENT = 64
+
+KB_ARTIFACT_PATH = os.environ.get('KB_ARTIFACT_PATH', os.path.join(RAG_INDEX_DIR, 'kb_artifact.bin'))
+
+
+class ArtifactError(Exception):
+    """Файл артефакта повреждён или имеет неизвестный формат"""
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ARTIFACT_ALIGNMENT) * ARTIFACT_ALIGNMENT
+
+
+def write_artifact(path: str, header: dict, arrays: Dict[str, np.ndarray]):
+    """
+    Атомарно записывает артефакт: magic, длина и JSON-заголовок, затем сырые массивы
+    (смещения, dtype и формы перечислены в заголовке под ключом 'arrays')
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps(
+        {**header, 'format_version': ARTIFACT_FORMAT_VERSION, 'arrays': layout}, ensure_ascii=False
+    ).encode('utf-8')
+    data_start = _aligned(len(ARTIFACT_MAGIC) + 8 + len(header_bytes))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(ARTIFACT_MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]['offset'])
+            file.write(array.tobytes())
+        file.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_artifact(path: str) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Заголовок и массивы артефакта; массивы отображаются в память (memory-map), а не читаются"""
+    with open(path, 'rb') as file:
+        if file.read(len(ARTIFACT_MAGIC)) != ARTIFACT_MAGIC:
+            raise ArtifactError(f"{path} is not a knowledge base artifact")
+        header_size, = struct.unpack('<Q', file.read(8))
+        try:
+            header = json.loads(file.read(header_size).decode('utf-8'))
+        except ValueError as e:
+            raise ArtifactError(f"{path} has a corrupted header: {e}")
+    if header.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ArtifactError(f"{path} has format version {header.get('format_version')}, "
+                            f"expected {ARTIFACT_FORMAT_VERSION}")
+
+    data_start = _aligned(len(ARTIFACT_MAGIC) + 8 + header_size)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        shape = tuple(spec['shape'])
+        if 0 in shape:
+            arrays[name] = np.empty(shape, dtype=spec['dtype'])
+            continue
+        arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r', offset=data_start + spec['offset'], shape=shape)
+    return header, arrays
+
+
+def read_artifact_header(path: str) -> Optional[dict]:
+    """Только заголовок артефакта (без массивов) или None, если файла нет или он не читается"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return read_artifact(path)[0]
+    except (OSError, ArtifactError, KeyError, struct.error):
+        return None
@@ -0,0 +1,81 @@
+"""Benchmark: sparse-matrix BM25 vs. rank_bm25.BM25Okapi (index build and per-query latency).
+
+The corpus is synthesised from the words of the knowledge base file, so it has a realistic
+Russian vocabulary at any size. BM25Okapi scores with whitespace tokens (as the bot used to),
+SparseBM25 with the stemming tokenizer the bot uses now.
+
+Usage:
+    python -m RAG.benchmarks.bm25 --docs 1000 10000 50000 --source data.txt
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from RAG.bm25 import SparseBM25, tokenize
+
+
+def synthetic_corpus(words, n_docs, n_queries, doc_words=120, query_words=6, seed=0):
+    """Documents and queries sampled from the knowledge base vocabulary with a Zipf-like skew."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+    vocabulary = np.array(words)
+    docs = [' '.join(vocabulary[rng.choice(len(words), doc_words, p=weights)]) for _ in range(n_docs)]
+    queries = [' '.join(vocabulary[rng.choice(len(words), query_words)]) for _ in range(n_queries)]
+    return docs, queries
+
+
+def timed_scores(get_scores, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        get_scores(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--source", default="data.txt", help="text file to take the vocabulary from")
+    parser.add_argument("--skip-okapi-above", type=int, default=50000,
+                        help="do not run BM25Okapi on larger corpora (it is very slow)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    with open(args.source, 'r', encoding='utf-8') as file:
+        words = list(dict.fromkeys(file.read().split()))
+
+    for n_docs in args.docs:
+        docs, queries = synthetic_corpus(words, n_docs, args.queries)
+        results = []
+
+        start = time.perf_counter()
+        sparse_bm25 = SparseBM25([tokenize(doc) for doc in docs])
+        build_seconds = time.perf_counter() - start
+        latency = timed_scores(lambda query: sparse_bm25.get_scores(tokenize(query)), queries)
+        results.append({"engine": "sparse", "build_s": build_seconds,
+                        "p50_ms": float(np.percentile(latency, 50)), "p99_ms": float(np.percentile(latency, 99))})
+
+        if n_docs <= args.skip_okapi_above:
+            start = time.perf_counter()
+            okapi = BM25Okapi([doc.split() for doc in docs])
+            build_seconds = time.perf_counter() - start
+            latency = timed_scores(lambda query: okapi.get_scores(query.split()), queries)
+            results.append({"engine": "okapi", "build_s": build_seconds,
+                            "p50_ms": float(np.percentile(latency, 50)), "p99_ms": float(np.percentile(latency, 99))})
+
+        for result in results:
+            if args.json:
+                print(json.dumps({"docs": n_docs, **result}))
+            else:
+                print(f"docs={n_docs:<7} {result['engine']:<6} build={result['build_s']:.2f} s  "
+                      f"p50={result['p50_ms']:.3f} ms  p99={result['p99_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Deterministic offline embedding backend for benchmarks.
+
+Embeddings are L2-normalised bags of hashed character trigrams: texts sharing word fragments
+get similar vectors, which is a different signal from the stemmed BM25 tokens, and no network
+access or API key is needed. Absolute quality numbers are therefore not those of the OpenAI
+models, but they are stable between runs and good for regression comparison.
+"""
+import hashlib
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from RAG.rag import EMBEDDING_MODEL, EmbeddingService
+from RAG.vector_index import normalize_rows
+
+# Russian text averages about three characters per cl100k_base token
+CHARS_PER_TOKEN = 3
+
+
+def hashed_embeddings(texts, dim=256):
+    """Bag of hashed character trigrams, L2-normalised."""
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        text = ' '.join(text.lower().split())
+        for start in range(len(text) - 2):
+            digest = hashlib.md5(text[start:start + 3].encode('utf-8')).digest()
+            vectors[row, int.from_bytes(digest[:4], 'little') % dim] += 1.0
+    return normalize_rows(vectors)
+
+
+class FakeEmbeddingService(EmbeddingService):
+    """EmbeddingService with the OpenAI calls and the tiktoken splitter and counts replaced by local ones."""
+    _instance = None
+    dim = 256
+
+    def split_text_into_chunks(self, text, chunk_size, chunk_overlap):
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size * CHARS_PER_TOKEN, chunk_overlap=chunk_overlap * CHARS_PER_TOKEN
+        )
+        return splitter.split_text(text)
+
+    def count_tokens(self, texts):
+        return np.array([-(-len(text) // CHARS_PER_TOKEN) for text in texts], dtype=np.int32)
+
+    def get_embeddings_for_documents(self, documents, model=EMBEDDING_MODEL):
+        return hashed_embeddings([doc.page_content for doc in documents], self.dim)
+
+    def get_openai_embedding(self, text, model=EMBEDDING_MODEL):
+        return hashed_embeddings([text], self.dim)[0]
+
+    async def aget_openai_embedding(self, text, model=EMBEDDING_MODEL):
+        return hashed_embeddings([text], self.dim)[0]
+
+    def embed_batch(self, texts, model=EMBEDDING_MODEL):
+        return list(hashed_embeddings(texts, self.dim))
@@ -0,0 +1,121 @@
+"""Benchmark: fusion strategies for hybrid retrieval (retrieval quality and per-query latency).
+
+Quality is measured on the knowledge base file: it is cut into chunks, each query is a noisy
+fragment of one chunk (words dropped and replaced), and the answer is that chunk. Latency is
+measured on a synthetic corpus of the requested size built from the same vocabulary.
+Embeddings come from the offline fake backend (hashed character trigrams), so the vector side
+is a genuinely different signal from the stemmed BM25 tokens.
+
+Usage:
+    python -m RAG.benchmarks.fusion --source data.txt --docs 10000 50000 --alpha 0.3 0.5 0.7
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from RAG.benchmarks.fake_backend import hashed_embeddings
+from RAG.bm25 import SparseBM25, tokenize
+from RAG.fusion import FUSION_STRATEGIES, create_fusion_strategy
+from RAG.rag import KnowledgeIndex
+from RAG.vector_index import create_vector_index
+
+
+def build_index(texts, vector_index="exact"):
+    embeddings = hashed_embeddings(texts)
+    index = create_vector_index(vector_index)
+    index.build(embeddings)
+    return KnowledgeIndex(
+        [Document(page_content=text) for text in texts], embeddings, index,
+        SparseBM25([tokenize(text) for text in texts]), version="benchmark",
+    )
+
+
+def noisy_queries(chunks, vocabulary, n_queries, words=8, noise=0.3, seed=0):
+    """Fragments of random chunks with part of the words replaced; returns (queries, answer ids)."""
+    rng = np.random.default_rng(seed)
+    queries, answers = [], []
+    for _ in range(n_queries):
+        answer = int(rng.integers(len(chunks)))
+        chunk_words = chunks[answer].split()
+        start = int(rng.integers(max(1, len(chunk_words) - words)))
+        fragment = chunk_words[start:start + words]
+        fragment = [vocabulary[rng.integers(len(vocabulary))] if rng.random() < noise else word
+                    for word in fragment]
+        queries.append(' '.join(fragment))
+        answers.append(answer)
+    return queries, answers
+
+
+def evaluate(index, strategy, queries, answers, k, alpha):
+    embeddings = hashed_embeddings(queries)
+    hits, reciprocal_ranks, latencies = 0, [], []
+    positions = {id(document): row for row, document in enumerate(index.documents)}
+    for query, embedding, answer in zip(queries, embeddings, answers):
+        start = time.perf_counter()
+        documents = index.rank_documents(strategy, [index.bm25_scores(query)], [embedding], k, alpha)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        ranked = [positions[id(document)] for document in documents]
+        if answer in ranked:
+            hits += 1
+            reciprocal_ranks.append(1 / (ranked.index(answer) + 1))
+        else:
+            reciprocal_ranks.append(0.0)
+    return hits / len(queries), float(np.mean(reciprocal_ranks)), np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="data.txt", help="knowledge base text file")
+    parser.add_argument("--chunk-size", type=int, default=400, help="chunk size in characters")
+    parser.add_argument("--docs", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--alpha", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--strategies", nargs="+", default=list(FUSION_STRATEGIES))
+    parser.add_argument("--vector-index", default="exact")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    with open(args.source, 'r', encoding='utf-8') as file:
+        text = file.read()
+    chunks = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=0).split_text(text)
+    vocabulary = list(dict.fromkeys(text.split()))
+    rng = np.random.default_rng(1)
+
+    results = []
+    quality_index = build_index(chunks, args.vector_index)
+    queries, answers = noisy_queries(chunks, vocabulary, args.queries)
+    for name in args.strategies:
+        for alpha in args.alpha:
+            recall, mrr, _ = evaluate(quality_index, create_fusion_strategy(name), queries, answers, args.k, alpha)
+            results.append({"strategy": name, "alpha": alpha, "docs": len(chunks),
+                            f"recall@{args.k}": recall, "mrr": mrr})
+
+    for n_docs in args.docs:
+        # Synthetic documents: shuffled words of real chunks
+        texts = [' '.join(rng.permutation(chunks[i % len(chunks)].split())) for i in range(n_docs)]
+        index = build_index(texts, args.vector_index)
+        sample, answers = noisy_queries(texts, vocabulary, args.queries)
+        for name in args.strategies:
+            _, _, latency = evaluate(index, create_fusion_strategy(name), sample, answers, args.k, args.alpha[0])
+            results.append({"strategy": name, "alpha": args.alpha[0], "docs": n_docs,
+                            "p50_ms": float(np.percentile(latency, 50)),
+                            "p99_ms": float(np.percentile(latency, 99))})
+
+    for result in results:
+        if args.json:
+            print(json.dumps({"k": args.k, **result}))
+        elif "mrr" in result:
+            print(f"quality  {result['strategy']:<9} alpha={result['alpha']:.2f} chunks={result['docs']:<6} "
+                  f"recall@{args.k}={result[f'recall@{args.k}']:.3f}  mrr={result['mrr']:.3f}")
+        else:
+            print(f"latency  {result['strategy']:<9} docs={result['docs']:<7} "
+                  f"p50={result['p50_ms']:.3f} ms  p99={result['p99_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
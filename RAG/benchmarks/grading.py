@@ -0,0 +1,150 @@
+"""Benchmark: per-document vs. single-call batch relevance grading.
+
+For every labeled question the top-k chunks are retrieved offline (fake embedding backend, see
+RAG/benchmarks/fake_backend.py) and graded twice: with one retrieval grader call per chunk, issued
+concurrently as in the graph, and with one batch grader call for all chunks. Reports wall-clock
+latency, prompt/completion tokens and the agreement of the batch verdicts with the per-document ones.
+
+The graders are real LLM calls: OPENAI_API_KEY (and optionally OPENAI_BASE_URL for any
+OpenAI-compatible server) must be set. The grader cache is disabled for the run.
+
+Usage:
+    python -m RAG.benchmarks.grading --questions-limit 20 --k 5
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+from RAG.benchmarks.retrieval import DEFAULT_QUESTIONS
+
+
+class TokenCounter(BaseCallbackHandler):
+    """Sums the token usage reported by the chat model."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.requests = 0
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        self.prompt_tokens += usage.get('prompt_tokens', 0)
+        self.completion_tokens += usage.get('completion_tokens', 0)
+        self.requests += 1
+
+
+async def grade_per_document(grader, question, documents, counter):
+    results = await asyncio.gather(*[
+        grader.ainvoke({"question": question, "document": document}, {"callbacks": [counter]})
+        for document in documents
+    ])
+    return [result.binary_score == "yes" for result in results]
+
+
+async def grade_batch(grader, question, documents, counter):
+    from RAG.functions import format_documents_for_batch_grading
+
+    result = await grader.ainvoke(
+        {"question": question, "documents": format_documents_for_batch_grading(documents)},
+        {"callbacks": [counter]},
+    )
+    verdicts = {grade.id: grade.binary_score == "yes" for grade in result.grades}
+    # A missing verdict counts as relevant, as in the graph
+    return [verdicts.get(position, True) for position in range(len(documents))]
+
+
+async def run(service, graders, questions, k):
+    """graders maps the mode name to (grader, grading coroutine function)."""
+    stats = {mode: {'latencies': [], 'counter': TokenCounter()} for mode in graders}
+    agree = total = batch_only = per_document_only = 0
+    for item in questions:
+        documents = service.fusion_retrieval(item['question'], k=k)
+        verdicts = {}
+        for mode, (grader, grade) in graders.items():
+            start = time.perf_counter()
+            verdicts[mode] = await grade(grader, item['question'], documents, stats[mode]['counter'])
+            stats[mode]['latencies'].append((time.perf_counter() - start) * 1000)
+        for single, joint in zip(verdicts['per_document'], verdicts['batch']):
+            total += 1
+            agree += single == joint
+            batch_only += joint and not single
+            per_document_only += single and not joint
+
+    results = []
+    for mode, item in stats.items():
+        counter = item['counter']
+        results.append({
+            'mode': mode,
+            'questions': len(questions),
+            'k': k,
+            'requests_per_question': counter.requests / len(questions),
+            'prompt_tokens_per_question': counter.prompt_tokens / len(questions),
+            'completion_tokens_per_question': counter.completion_tokens / len(questions),
+            'p50_ms': float(np.percentile(item['latencies'], 50)),
+            'p95_ms': float(np.percentile(item['latencies'], 95)),
+        })
+    agreement = {
+        'documents': total,
+        'agreement': agree / total if total else 0.0,
+        'relevant_only_in_batch': batch_only,
+        'relevant_only_per_document': per_document_only,
+    }
+    return results, agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="data.txt", help="knowledge base file or directory")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="labeled questions (JSON)")
+    parser.add_argument("--questions-limit", type=int, default=20, help="grade only the first N questions")
+    parser.add_argument("--k", type=int, default=5, help="chunks graded per question")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    # Same isolation as the retrieval suite; verdicts must come from the model, not the cache
+    workdir = tempfile.mkdtemp(prefix='rag-bench-')
+    os.environ['KNOWLEDGE_BASE_PATH'] = args.source
+    os.environ['RAG_INDEX_DIR'] = os.path.join(workdir, 'index')
+    os.environ['KB_ARTIFACT_PATH'] = os.path.join(workdir, 'kb_artifact.bin')
+    os.environ['QUERY_CACHE_PATH'] = ''
+    os.environ['KB_WATCH_INTERVAL'] = '0'
+    os.environ['GRADER_CACHE_SIZE'] = '0'
+
+    from RAG.benchmarks.fake_backend import FakeEmbeddingService
+    from RAG.functions import initialize_batch_grader, initialize_grader
+
+    with open(args.questions, 'r', encoding='utf-8') as file:
+        questions = json.load(file)[:args.questions_limit]
+    with contextlib.redirect_stdout(sys.stderr):
+        service = FakeEmbeddingService()
+    graders = {
+        'per_document': (initialize_grader(), grade_per_document),
+        'batch': (initialize_batch_grader(), grade_batch),
+    }
+
+    results, agreement = asyncio.run(run(service, graders, questions, args.k))
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        print(json.dumps(agreement))
+        return
+    for result in results:
+        print(f"{result['mode']:<13} requests/q={result['requests_per_question']:.1f}  "
+              f"prompt tok/q={result['prompt_tokens_per_question']:.0f}  "
+              f"completion tok/q={result['completion_tokens_per_question']:.0f}  "
+              f"p50={result['p50_ms']:.0f} ms  p95={result['p95_ms']:.0f} ms")
+    print(f"agreement {agreement['agreement']:.3f} over {agreement['documents']} documents "
+          f"(relevant only in batch: {agreement['relevant_only_in_batch']}, "
+          f"only per document: {agreement['relevant_only_per_document']})")
+
+
+if __name__ == "__main__":
+    main()
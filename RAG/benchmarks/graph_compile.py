@@ -0,0 +1,51 @@
+"""Benchmark: per-request graph compilation vs. the shared compiled-graph registry.
+
+Usage:
+    python -m RAG.benchmarks.graph_compile --iterations 200
+"""
+import argparse
+import statistics
+import time
+
+from RAG.building_and_running_graph import GraphRegistry, build_workflow, DEFAULT_PIPELINE
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _measure(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _report(name, timings):
+    print(f"{name:<28} mean={statistics.mean(timings):8.3f} ms  "
+          f"p50={_percentile(timings, 50):8.3f} ms  p95={_percentile(timings, 95):8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    registry = GraphRegistry()
+    registry.register(DEFAULT_PIPELINE, build_workflow)
+    registry.warm_up()
+
+    per_request = _measure(lambda: build_workflow().compile(), args.iterations)
+    shared = _measure(lambda: registry.get(DEFAULT_PIPELINE), args.iterations)
+
+    _report("build + compile per request", per_request)
+    _report("shared registry lookup", shared)
+    print(f"saved per request: {statistics.mean(per_request) - statistics.mean(shared):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""Load generator for run_graph and the OpenAIHelper methods.
+
+Requests arrive open-loop at --rps (evenly spaced or Poisson) for --duration seconds, whatever
+the response times, so a slow backend shows up as growing latency instead of a lower request rate.
+Latency is measured from the scheduled arrival time. A request arriving while --max-in-flight
+requests are pending is dropped and counted. The scenario of each request is drawn from --mix:
+
+* run_graph, run_graph_stream: the RAG graph, without and with a draft callback;
+* chat, chat_stream: OpenAIHelper.get_chat_response(_stream);
+* image, speech, transcribe: generate_image, generate_speech and transcribe (a silent WAV).
+
+Without --base-url the local mock server (RAG/benchmarks/mock_openai.py) is started in-process,
+configured with --mock-args; pass --base-url to load a mock started separately (its event loop
+then does not compete with the load generator) or any OpenAI-compatible server. The knowledge
+base is indexed into a temporary directory through the same endpoint, and the grader cache and
+the semantic answer cache are off unless --grader-cache / --answer-cache are given. Offline,
+tiktoken needs its encoding files cached (TIKTOKEN_CACHE_DIR).
+
+Reports throughput and p50/p90/p95/p99 latency per scenario (time to the first draft for the
+streaming ones), the per-node graph metrics and the requests seen by the in-process mock.
+
+Usage:
+    python -m RAG.benchmarks.load --rps 20 --duration 60 --mix run_graph=4,chat_stream=1 \\
+        --mock-args "--latency chat=lognormal:400,0.5 --latency embeddings=fixed:40 --rate-limit-rate 0.01"
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shlex
+import sys
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+from RAG.benchmarks.retrieval import DEFAULT_QUESTIONS
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class ScenarioStats:
+    def __init__(self):
+        self.latencies = []
+        self.first_latencies = []
+        self.errors = Counter()
+        self.sent = 0
+        self.dropped = 0
+
+    def summary(self, elapsed):
+        result = {
+            'sent': self.sent,
+            'ok': len(self.latencies),
+            'errors': dict(self.errors),
+            'dropped': self.dropped,
+            'throughput_rps': len(self.latencies) / elapsed if elapsed else 0.0,
+        }
+        for name, values in (('latency', self.latencies), ('first', self.first_latencies)):
+            if values:
+                result.update({f'{name}_p{q}_ms': float(np.percentile(values, q)) for q in PERCENTILES})
+                result[f'{name}_max_ms'] = float(np.max(values))
+        return result
+
+
+def helper_config(model):
+    """OpenAIHelper configuration with the defaults of main.py."""
+    from openai_helper import default_max_tokens
+
+    return {
+        'api_key': os.environ['OPENAI_API_KEY'],
+        'show_usage': False,
+        'stream': True,
+        'proxy': None,
+        'max_history_size': 15,
+        'max_conversation_age_minutes': 180,
+        'assistant_prompt': 'You are a helpful assistant.',
+        'max_tokens': default_max_tokens(model=model),
+        'n_choices': 1,
+        'temperature': 0.3,
+        'image_model': 'dall-e-2',
+        'image_quality': 'standard',
+        'image_style': 'vivid',
+        'image_size': '512x512',
+        'model': model,
+        'enable_functions': False,
+        'functions_max_consecutive_calls': 10,
+        'presence_penalty': 0.0,
+        'frequency_penalty': 0.0,
+        'bot_language': 'ru',
+        'show_plugins_used': False,
+        'whisper_prompt': '',
+        'vision_model': 'gpt-4-vision-preview',
+        'enable_vision_follow_up_questions': True,
+        'vision_prompt': 'What is in this image',
+        'vision_detail': 'auto',
+        'vision_max_tokens': 300,
+        'tts_model': 'tts-1',
+        'tts_voice': 'alloy',
+    }
+
+
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def scenario_run_graph(context, chat_id, question, first_token):
+    from RAG.building_and_running_graph import run_graph
+
+    await run_graph(context['helper'], chat_id, question, pipeline=context['pipeline'],
+                    use_cache=context['answer_cache'])
+
+
+async def scenario_run_graph_stream(context, chat_id, question, first_token):
+    from RAG.building_and_running_graph import run_graph
+
+    async def on_draft(text):
+        first_token()
+
+    await run_graph(context['helper'], chat_id, question, pipeline=context['pipeline'],
+                    use_cache=context['answer_cache'], on_draft=on_draft)
+
+
+async def scenario_chat(context, chat_id, question, first_token):
+    await context['helper'].get_chat_response(chat_id=chat_id, query=question)
+
+
+async def scenario_chat_stream(context, chat_id, question, first_token):
+    async for _ in context['helper'].get_chat_response_stream(chat_id=chat_id, query=question):
+        first_token()
+
+
+async def scenario_image(context, chat_id, question, first_token):
+    await context['helper'].generate_image(prompt=question)
+
+
+async def scenario_speech(context, chat_id, question, first_token):
+    await context['helper'].generate_speech(text=question)
+
+
+async def scenario_transcribe(context, chat_id, question, first_token):
+    await context['helper'].transcribe(context['audio_path'])
+
+
+SCENARIOS = {
+    'run_graph': scenario_run_graph,
+    'run_graph_stream': scenario_run_graph_stream,
+    'chat': scenario_chat,
+    'chat_stream': scenario_chat_stream,
+    'image': scenario_image,
+    'speech': scenario_speech,
+    'transcribe': scenario_transcribe,
+}
+
+
+async def drive(context, mix, questions, args):
+    """Issues the requests on schedule; returns ({scenario: ScenarioStats}, elapsed seconds)."""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+    names, weights = list(mix), list(mix.values())
+    stats = {name: ScenarioStats() for name in names}
+    pending = set()
+
+    async def measure(name, scheduled, chat_id, question):
+        first = []
+
+        def first_token():
+            if not first:
+                first.append(loop.time())
+
+        try:
+            await SCENARIOS[name](context, chat_id, question, first_token)
+        except Exception as e:
+            stats[name].errors[type(e.__cause__ or e).__name__] += 1
+            return
+        stats[name].latencies.append((loop.time() - scheduled) * 1000)
+        if first:
+            stats[name].first_latencies.append((first[0] - scheduled) * 1000)
+
+    started = loop.time()
+    scheduled = started
+    for number in range(int(args.rps * args.duration)):
+        if number:
+            scheduled += rng.expovariate(args.rps) if args.arrival == 'poisson' else 1 / args.rps
+        await asyncio.sleep(max(scheduled - loop.time(), 0))
+        name = rng.choices(names, weights)[0]
+        stats[name].sent += 1
+        if len(pending) >= args.max_in_flight:
+            stats[name].dropped += 1
+            continue
+        task = asyncio.create_task(measure(name, scheduled, 1 + number % args.users, rng.choice(questions)))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+    return stats, loop.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint; default: start the mock server in-process")
+    parser.add_argument("--mock-args", default="", help="options of the in-process mock server (mock_openai --help)")
+    parser.add_argument("--rps", type=float, default=5, help="target request rate")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="constant")
+    parser.add_argument("--mix", default="run_graph", help=f"weighted scenarios, e.g. run_graph=4,chat=1 "
+                                                           f"({', '.join(SCENARIOS)})")
+    parser.add_argument("--users", type=int, default=50, help="distinct chat ids the requests are spread over")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="drop arrivals beyond this many pending")
+    parser.add_argument("--pipeline", default="default", help="run_graph pipeline (graph_registry)")
+    parser.add_argument("--answer-cache", action="store_true", help="let run_graph use the semantic answer cache")
+    parser.add_argument("--grader-cache", action="store_true", help="keep the grader verdict cache on")
+    parser.add_argument("--model", default=os.environ.get('OPENAI_MODEL', 'gpt-4o-mini'))
+    parser.add_argument("--source", default="data.txt", help="knowledge base file or directory")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="questions (JSON with 'question' fields)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the arrival times, scenarios and questions")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    server = None
+    if args.base_url is None:
+        from RAG.benchmarks.mock_openai import MockServerThread, build_parser, create_mock
+
+        server = MockServerThread(create_mock(build_parser().parse_args(shlex.split(args.mock_args))))
+        args.base_url = server.start()
+
+    # Same isolation as the other benchmarks; everything goes to the endpoint under test
+    workdir = tempfile.mkdtemp(prefix='rag-load-')
+    os.environ['OPENAI_BASE_URL'] = args.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'mock')
+    os.environ['OPENAI_MODEL'] = args.model
+    os.environ['KNOWLEDGE_BASE_PATH'] = args.source
+    os.environ['RAG_INDEX_DIR'] = os.path.join(workdir, 'index')
+    os.environ['KB_ARTIFACT_PATH'] = os.path.join(workdir, 'kb_artifact.bin')
+    os.environ['QUERY_CACHE_PATH'] = ''
+    os.environ['KB_WATCH_INTERVAL'] = '0'
+    os.environ['GRAPH_METRICS_LOG_INTERVAL'] = '0'
+    if not args.grader_cache:
+        os.environ['GRADER_CACHE_SIZE'] = '0'
+
+    from openai_helper import OpenAIHelper
+    from plugin_manager import PluginManager
+    from RAG.benchmarks.mock_openai import silent_wav
+
+    audio_path = os.path.join(workdir, 'voice.wav')
+    with open(audio_path, 'wb') as file:
+        file.write(silent_wav(3.0))
+    context = {
+        'helper': OpenAIHelper(config=helper_config(args.model), plugin_manager=PluginManager(config={'plugins': []})),
+        'pipeline': args.pipeline,
+        'answer_cache': args.answer_cache,
+        'audio_path': audio_path,
+    }
+    if {'run_graph', 'run_graph_stream'} & set(mix):
+        # Builds the index and compiles the graphs before the clock starts
+        with contextlib.redirect_stdout(sys.stderr):
+            from RAG.building_and_running_graph import graph_registry
+        graph_registry.get(args.pipeline)
+    with open(args.questions, 'r', encoding='utf-8') as file:
+        questions = [item['question'] for item in json.load(file)]
+
+    # The graph nodes print their progress; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        stats, elapsed = asyncio.run(drive(context, mix, questions, args))
+
+    results = [{'scenario': name, **item.summary(elapsed)} for name, item in stats.items()]
+    mock_stats = server.mock.snapshot() if server is not None else None
+    if server is not None:
+        server.stop()
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        if mock_stats is not None:
+            print(json.dumps({'mock': mock_stats}))
+        return
+
+    print(f"{args.rps:g} rps ({args.arrival}) for {args.duration:g} s against {args.base_url}, "
+          f"finished in {elapsed:.1f} s")
+    for result in results:
+        line = (f"{result['scenario']:<17} sent={result['sent']} ok={result['ok']} dropped={result['dropped']} "
+                f"throughput={result['throughput_rps']:.2f}/s")
+        if 'latency_p50_ms' in result:
+            line += ' latency ' + ' '.join(f"p{q}={result[f'latency_p{q}_ms']:.0f}" for q in PERCENTILES)
+            line += f" max={result['latency_max_ms']:.0f} ms"
+        if 'first_p50_ms' in result:
+            line += f"  first draft p50={result['first_p50_ms']:.0f} p95={result['first_p95_ms']:.0f} ms"
+        print(line)
+        if result['errors']:
+            print(f"{'':<17} errors: {', '.join(f'{name}={count}' for name, count in result['errors'].items())}")
+    if {'run_graph', 'run_graph_stream'} & set(mix):
+        from RAG.graph_metrics import graph_metrics
+
+        print("graph stages:")
+        print(graph_metrics.summary())
+    if mock_stats is not None:
+        print(f"mock server: requests {mock_stats['requests']}, injected errors {mock_stats['injected']}")
+
+
+if __name__ == "__main__":
+    main()
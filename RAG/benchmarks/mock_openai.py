@@ -0,0 +1,499 @@
+"""Local OpenAI-compatible mock server for load tests and offline runs.
+
+Serves the endpoints the bot uses, without network access or API credits:
+
+* POST /v1/chat/completions: plain, streaming (SSE), n choices, legacy functions and tools
+  (forced tool_choice, as sent by with_structured_output, always gets a call) and
+  json_schema response_format. Arguments are generated from the JSON schema; string fields get
+  --verdict, so the RAG graders accept by default;
+* POST /v1/embeddings: hashed character trigram vectors (see fake_backend.hashed_embeddings) of
+  the model's dimension, float or base64;
+* POST /v1/audio/transcriptions, POST /v1/audio/speech (always a silent 8 kHz WAV),
+  POST /v1/images/generations (URL served by GET /mock/images/<name>.png, or b64_json);
+* GET /v1/models and GET /mock/stats (request counts, injected errors).
+
+Response bodies depend only on the request, so they are deterministic. Latency and error
+injection come from a seeded random stream: the n-th request always draws the same values.
+Latency specs are <distribution>:<parameters in ms> (fixed:100, uniform:50,150, normal:200,50,
+lognormal:<median>,<sigma>, exponential:<mean>) given per endpoint (chat, embeddings,
+transcriptions, speech, images) or as default. For chat completions the latency is the time to
+the first token; every completion token then takes --token-interval.
+
+Usage:
+    python -m RAG.benchmarks.mock_openai --port 8089 --latency chat=lognormal:400,0.6 \\
+        --token-interval fixed:8 --rate-limit-rate 0.02 --error-rate 0.005
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock python main.py
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import random
+import struct
+import threading
+import time
+import wave
+import zlib
+from collections import Counter
+
+import numpy as np
+from aiohttp import web
+
+ENDPOINTS = ("chat", "embeddings", "transcriptions", "speech", "images")
+
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+# Deterministic answers are stitched from these sentences
+SENTENCES = (
+    "Франшиза ЖизньМарт помогает открыть магазин у дома с готовой моделью работы.",
+    "Партнёр получает обучение, поддержку управляющего и доступ к поставщикам сети.",
+    "Размер вложений зависит от площади помещения и выбранного формата магазина.",
+    "Точные условия уточняйте у менеджера по развитию франшизы.",
+    "Сеть берёт на себя маркетинг, а партнёр отвечает за работу точки.",
+    "Срок окупаемости обычно составляет от двенадцати до восемнадцати месяцев.",
+)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _fixed(rng, ms):
+    return ms
+
+
+def _uniform(rng, low, high):
+    return rng.uniform(low, high)
+
+
+def _normal(rng, mean, sd):
+    return max(rng.gauss(mean, sd), 0.0)
+
+
+def _lognormal(rng, median, sigma):
+    return median * float(np.exp(rng.gauss(0.0, sigma)))
+
+
+def _exponential(rng, mean):
+    return rng.expovariate(1.0 / mean) if mean else 0.0
+
+
+LATENCY_DISTRIBUTIONS = {
+    "fixed": (_fixed, 1),
+    "uniform": (_uniform, 2),
+    "normal": (_normal, 2),
+    "lognormal": (_lognormal, 2),
+    "exponential": (_exponential, 1),
+}
+
+
+def parse_latency(spec):
+    """'lognormal:400,0.6' -> function(rng) returning a delay in seconds."""
+    name, _, params = spec.partition(":")
+    if name not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Unknown latency distribution '{name}', expected one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+    sample, arity = LATENCY_DISTRIBUTIONS[name]
+    values = [float(value) for value in params.split(",")] if params else []
+    if len(values) != arity:
+        raise ValueError(f"Latency distribution '{name}' takes {arity} parameter(s), got '{spec}'")
+    return lambda rng: sample(rng, *values) / 1000
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).digest()
+
+
+def approximate_tokens(text):
+    return max(len(text) // 4, 1) if text else 0
+
+
+def sample_from_schema(schema, verdict, root=None):
+    """A minimal value valid for the JSON schema: one array item, first enum value, verdict for strings."""
+    root = root or schema
+    if "$ref" in schema:
+        name = schema["$ref"].rsplit("/", 1)[-1]
+        schema = root.get("$defs", root.get("definitions", {})).get(name, {})
+    if "enum" in schema:
+        return verdict if verdict in schema["enum"] else schema["enum"][0]
+    for combinator in ("anyOf", "oneOf", "allOf"):
+        if combinator in schema:
+            return sample_from_schema(schema[combinator][0], verdict, root)
+    kind = schema.get("type", "object")
+    if isinstance(kind, list):
+        kind = next((item for item in kind if item != "null"), "null")
+    if kind == "object":
+        return {name: sample_from_schema(value, verdict, root)
+                for name, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), verdict, root)]
+    if kind == "string":
+        return verdict
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return True
+    return None
+
+
+def silent_wav(seconds, rate=8000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(rate)
+        file.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def solid_png(width, height, color):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    row = b"\x00" + bytes(color) * width
+    return (PNG_SIGNATURE + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b""))
+
+
+class MockOpenAI:
+    """aiohttp application emulating the OpenAI REST API with injected latency and errors."""
+
+    def __init__(self, latencies=None, token_interval="fixed:0", error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, function_call_rate=0.0, verdict="yes", completion_words=60, seed=0):
+        latencies = dict(latencies or {})
+        default = latencies.pop("default", "fixed:0")
+        unknown = set(latencies) - set(ENDPOINTS)
+        if unknown:
+            raise ValueError(f"Unknown endpoint '{unknown.pop()}', expected one of {', '.join(ENDPOINTS)}")
+        self.latencies = {endpoint: parse_latency(latencies.get(endpoint, default)) for endpoint in ENDPOINTS}
+        self.token_interval = parse_latency(token_interval)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.function_call_rate = function_call_rate
+        self.verdict = verdict
+        self.completion_words = completion_words
+        self.seed = seed
+        self.requests = Counter()
+        self.injected = Counter()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+        self.app = web.Application(client_max_size=64 * 2 ** 20)
+        self.app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self.app.router.add_post("/v1/embeddings", self.embeddings)
+        self.app.router.add_post("/v1/audio/transcriptions", self.transcriptions)
+        self.app.router.add_post("/v1/audio/speech", self.speech)
+        self.app.router.add_post("/v1/images/generations", self.images)
+        self.app.router.add_get("/v1/models", self.models)
+        self.app.router.add_get("/mock/images/{name}.png", self.image_file)
+        self.app.router.add_get("/mock/stats", self.stats)
+
+    # Injection
+
+    def _draw(self, endpoint):
+        """Random stream of the next request: (latency in seconds, injected status or None, rng)."""
+        with self._lock:
+            self._sequence += 1
+            rng = random.Random(f"{self.seed}:{self._sequence}")
+            self.requests[endpoint] += 1
+        latency = self.latencies[endpoint](rng)
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            return latency, 429, rng
+        if roll < self.rate_limit_rate + self.error_rate:
+            return latency, 500, rng
+        return latency, None, rng
+
+    def _error(self, status):
+        self.injected[str(status)] += 1
+        if status == 429:
+            body = {"message": "Rate limit reached (injected by mock server)", "type": "requests",
+                    "param": None, "code": "rate_limit_exceeded"}
+            return web.json_response({"error": body}, status=429, headers={"retry-after": str(self.retry_after)})
+        body = {"message": "The server had an error while processing your request (injected by mock server)",
+                "type": "server_error", "param": None, "code": None}
+        return web.json_response({"error": body}, status=status)
+
+    # Chat completions
+
+    def _completion_text(self, seed, index):
+        words = []
+        sentence = int.from_bytes(digest(seed, index)[:4], "little")
+        while len(words) < self.completion_words:
+            words.extend(SENTENCES[sentence % len(SENTENCES)].split())
+            sentence += 1
+        return " ".join(words[:self.completion_words])
+
+    def _function_call(self, request, seed):
+        """(kind, name, arguments) of the call this request gets, or None for a text answer."""
+        messages = request.get("messages", [])
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format.get("json_schema", {}).get("schema", {})
+            return "json", None, json.dumps(sample_from_schema(schema, self.verdict), ensure_ascii=False)
+        if request.get("tools"):
+            kind, specs = "tool", [tool["function"] for tool in request["tools"]]
+            choice = request.get("tool_choice", "auto")
+        elif request.get("functions"):
+            kind, specs, choice = "function", request["functions"], request.get("function_call", "auto")
+        else:
+            return None
+        if isinstance(choice, dict):
+            name = choice.get("function", choice).get("name")
+            spec = next((spec for spec in specs if spec["name"] == name), specs[0])
+        elif choice == "none" or (messages and messages[-1].get("role") in ("function", "tool")):
+            return None
+        elif choice == "required" or int.from_bytes(seed[4:8], "little") / 2 ** 32 < self.function_call_rate:
+            spec = specs[0]
+        else:
+            return None
+        arguments = sample_from_schema(spec.get("parameters", {}), self.verdict)
+        return kind, spec["name"], json.dumps(arguments, ensure_ascii=False)
+
+    @staticmethod
+    def _call_message(kind, name, arguments, index):
+        if kind == "function":
+            return {"role": "assistant", "content": None, "function_call": {"name": name, "arguments": arguments}}, \
+                "function_call"
+        call = {"id": f"call_{index}", "type": "function", "function": {"name": name, "arguments": arguments}}
+        return {"role": "assistant", "content": None, "tool_calls": [call]}, "tool_calls"
+
+    async def chat_completions(self, request):
+        latency, status, rng = self._draw("chat")
+        body = await request.json()
+        messages = body.get("messages", [])
+        prompt = json.dumps(messages, ensure_ascii=False)
+        seed = digest(body.get("model"), messages[-1] if messages else None)
+        call = self._function_call(body, seed)
+        choices = []
+        for index in range(body.get("n") or 1):
+            if call is None:
+                text = self._completion_text(seed, index)
+                choices.append(({"role": "assistant", "content": text}, "stop", text))
+            elif call[0] == "json":
+                choices.append(({"role": "assistant", "content": call[2]}, "stop", call[2]))
+            else:
+                message, finish_reason = self._call_message(*call, index)
+                choices.append((message, finish_reason, call[2]))
+        completion_tokens = sum(len(text.split()) for _, _, text in choices)
+        usage = {"prompt_tokens": approximate_tokens(prompt), "completion_tokens": completion_tokens,
+                 "total_tokens": approximate_tokens(prompt) + completion_tokens}
+        head = {"id": f"chatcmpl-{seed.hex()[:24]}", "created": int(time.time()), "model": body.get("model"),
+                "system_fingerprint": "mock"}
+
+        await asyncio.sleep(latency)
+        if status is not None:
+            return self._error(status)
+        if not body.get("stream"):
+            # Tokens are produced one by one whether or not they are streamed
+            await asyncio.sleep(sum(self.token_interval(rng) for _ in range(completion_tokens)))
+            return web.json_response({
+                **head, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": index, "message": message, "finish_reason": finish_reason, "logprobs": None}
+                            for index, (message, finish_reason, _) in enumerate(choices)],
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(choices_delta, **extra):
+            chunk = {**head, "object": "chat.completion.chunk", "choices": choices_delta, **extra}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        for index, (message, finish_reason, text) in enumerate(choices):
+            await send([{"index": index, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            if message.get("function_call"):
+                await send([{"index": index, "finish_reason": None,
+                             "delta": {"function_call": {"name": message["function_call"]["name"], "arguments": ""}}}])
+            elif message.get("tool_calls"):
+                call = message["tool_calls"][0]
+                await send([{"index": index, "finish_reason": None, "delta": {"tool_calls": [
+                    {"index": 0, "id": call["id"], "type": "function",
+                     "function": {"name": call["function"]["name"], "arguments": ""}}]}}])
+            for position, word in enumerate(text.split(" ")):
+                await asyncio.sleep(self.token_interval(rng))
+                piece = word if position == 0 else " " + word
+                if message.get("function_call"):
+                    delta = {"function_call": {"arguments": piece}}
+                elif message.get("tool_calls"):
+                    delta = {"tool_calls": [{"index": 0, "function": {"arguments": piece}}]}
+                else:
+                    delta = {"content": piece}
+                await send([{"index": index, "delta": delta, "finish_reason": None}])
+            await send([{"index": index, "delta": {}, "finish_reason": finish_reason}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # Other endpoints
+
+    async def embeddings(self, request):
+        from RAG.benchmarks.fake_backend import hashed_embeddings
+
+        latency, status, _ = self._draw("embeddings")
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+        dim = body.get("dimensions") or EMBEDDING_DIMENSIONS.get(body.get("model"), 1536)
+        vectors = hashed_embeddings(texts, dim)
+        await asyncio.sleep(latency)
+        if status is not None:
+            return self._error(status)
+        if body.get("encoding_format") == "base64":
+            data = [base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii") for vector in vectors]
+        else:
+            data = [vector.tolist() for vector in vectors]
+        tokens = sum(approximate_tokens(text) for text in texts)
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model"),
+            "data": [{"object": "embedding", "index": index, "embedding": item} for index, item in enumerate(data)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def transcriptions(self, request):
+        latency, status, _ = self._draw("transcriptions")
+        fields = {}
+        async for part in await request.multipart():
+            fields[part.name] = await part.read()
+        audio = fields.get("file", b"")
+        text = SENTENCES[int.from_bytes(hashlib.sha256(audio).digest()[:4], "little") % len(SENTENCES)]
+        await asyncio.sleep(latency)
+        if status is not None:
+            return self._error(status)
+        response_format = fields.get("response_format", b"json").decode("utf-8")
+        if response_format in ("text", "srt", "vtt"):
+            return web.Response(text=text, content_type="text/plain")
+        if response_format == "verbose_json":
+            duration = max(len(audio) / 16000, 0.1)
+            return web.json_response({"task": "transcribe", "language": "russian", "duration": duration, "text": text,
+                                      "segments": [{"id": 0, "start": 0.0, "end": duration, "text": text}]})
+        return web.json_response({"text": text})
+
+    async def speech(self, request):
+        latency, status, _ = self._draw("speech")
+        body = await request.json()
+        # About 15 characters per second of speech, capped so that responses stay small
+        audio = silent_wav(min(len(body.get("input", "")) / 15, 10.0))
+        await asyncio.sleep(latency)
+        if status is not None:
+            return self._error(status)
+        return web.Response(body=audio, content_type="audio/wav")
+
+    async def images(self, request):
+        latency, status, _ = self._draw("images")
+        body = await request.json()
+        name = digest(body.get("prompt"), body.get("size")).hex()[:32]
+        width, _, height = (body.get("size") or "256x256").partition("x")
+        await asyncio.sleep(latency)
+        if status is not None:
+            return self._error(status)
+        data = []
+        for _ in range(body.get("n") or 1):
+            if body.get("response_format") == "b64_json":
+                png = solid_png(int(width), int(height or width), bytes.fromhex(name[:6]))
+                data.append({"b64_json": base64.b64encode(png).decode("ascii"), "revised_prompt": body.get("prompt")})
+            else:
+                url = f"{request.scheme}://{request.host}/mock/images/{name}.png?size={width}x{height or width}"
+                data.append({"url": url, "revised_prompt": body.get("prompt")})
+        return web.json_response({"created": int(time.time()), "data": data})
+
+    async def image_file(self, request):
+        name = request.match_info["name"]
+        width, _, height = request.query.get("size", "256x256").partition("x")
+        color = bytes.fromhex(name[:6]) if len(name) >= 6 else b"\x80\x80\x80"
+        return web.Response(body=solid_png(int(width), int(height or width), color), content_type="image/png")
+
+    async def models(self, request):
+        names = ["gpt-4o-mini", "gpt-4o", "whisper-1", "tts-1", "dall-e-2", "dall-e-3", *EMBEDDING_DIMENSIONS]
+        return web.json_response({"object": "list", "data": [
+            {"id": name, "object": "model", "created": 0, "owned_by": "mock"} for name in names]})
+
+    async def stats(self, request):
+        return web.json_response(self.snapshot())
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": dict(self.requests), "injected": dict(self.injected)}
+
+
+class MockServerThread:
+    """Runs a MockOpenAI app on its own event loop in a daemon thread (for in-process load tests)."""
+
+    def __init__(self, mock, host="127.0.0.1", port=0):
+        self.mock = mock
+        self.host = host
+        self.port = port
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        threading.Thread(target=self._run, name="mock-openai", daemon=True).start()
+        self._started.wait()
+        return self.base_url
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.mock.app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", action="append", default=[], metavar="[ENDPOINT=]SPEC",
+                        help=f"latency of {', '.join(ENDPOINTS)} or all endpoints (repeatable), e.g. chat=lognormal:400,0.6")
+    parser.add_argument("--token-interval", default="fixed:0", help="time per completion token, e.g. fixed:8")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of injected 429s, seconds")
+    parser.add_argument("--function-call-rate", type=float, default=0.0,
+                        help="share of chat requests offering functions that get a function call")
+    parser.add_argument("--verdict", default="yes", help="value of string fields in function arguments")
+    parser.add_argument("--completion-words", type=int, default=60, help="words (= tokens) per text completion")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the latency and error stream")
+    return parser
+
+
+def create_mock(args):
+    latencies = {}
+    for item in args.latency:
+        endpoint, _, spec = item.rpartition("=")
+        latencies[endpoint or "default"] = spec
+    return MockOpenAI(latencies, args.token_interval, args.error_rate, args.rate_limit_rate, args.retry_after,
+                      args.function_call_rate, args.verdict, args.completion_words, args.seed)
+
+
+def main():
+    args = build_parser().parse_args()
+    mock = create_mock(args)
+    print(f"Mock OpenAI API on http://{args.host}:{args.port}/v1")
+    web.run_app(mock.app, host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark: float32 / float16 / int8 embedding storage (memory, recall@k vs. float32, latency).
+
+int8 is scored both as is and with the shortlist reranked against full-precision vectors
+(in the bot they are memory-mapped from the embedding store, here they are an in-memory array).
+Uses the synthetic clustered corpus of the vector index benchmark, so it runs offline.
+
+Usage:
+    python -m RAG.benchmarks.quantization --docs 20000 100000 --dim 1536 --rerank 32 100
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from RAG.benchmarks.vector_index import recall_at_k, synthetic_corpus, timed_search
+from RAG.vector_index import ExactIndex, QuantizedVectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, nargs="+", default=[20000])
+    parser.add_argument("--dim", type=int, default=1536, help="1536 for text-embedding-3-small")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[32, 100])
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    for n_docs in args.docs:
+        docs, queries = synthetic_corpus(n_docs, args.dim, args.queries)
+        truth = None
+        configs = [("float32", 0), ("float16", 0), ("int8", 0)] + [("int8", rerank) for rerank in args.rerank]
+        for dtype, rerank in configs:
+            start = time.perf_counter()
+            vectors = QuantizedVectors(docs, dtype)
+            build_seconds = time.perf_counter() - start
+            index = ExactIndex(rerank=rerank)
+            index.build(vectors)
+            if rerank:
+                index.set_full_precision(docs)
+            found, latency = timed_search(index, queries, args.k)
+            if truth is None:
+                truth = found
+            result = {
+                "docs": n_docs, "dim": args.dim, "dtype": dtype, "rerank": rerank,
+                "mib": vectors.nbytes / 2 ** 20, "quantize_s": build_seconds,
+                f"recall@{args.k}": recall_at_k(truth, found),
+                "p50_ms": float(np.percentile(latency, 50)), "p99_ms": float(np.percentile(latency, 99)),
+            }
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"docs={n_docs:<7} {dtype:<8} rerank={rerank:<4} {result['mib']:8.1f} MiB  "
+                      f"recall@{args.k}={result[f'recall@{args.k}']:.3f}  "
+                      f"p50={result['p50_ms']:.2f} ms  p99={result['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
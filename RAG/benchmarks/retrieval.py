@@ -0,0 +1,250 @@
+"""Retrieval benchmark and quality suite for EmbeddingService.fusion_retrieval.
+
+Runs fully offline on the deterministic fake embedding backend (RAG/benchmarks/fake_backend.py):
+
+* quality: recall@k and MRR of fusion_retrieval on a labeled set of Russian questions about
+  ЖизньМарт (RAG/benchmarks/data/zhiznmart_questions.json). A retrieved chunk is relevant when it
+  contains the labeled answer phrase, so the labels do not depend on chunk boundaries;
+* scale: fusion_retrieval latency and index memory on synthetic corpora of the given sizes
+  (up to 1M chunks) built from the knowledge base vocabulary.
+
+Results are written as one JSON document; pass a previous result as --baseline to compare
+and get a non-zero exit code when recall or MRR drops by more than --tolerance.
+
+Usage:
+    python -m RAG.benchmarks.retrieval --output results.json
+    python -m RAG.benchmarks.retrieval --sizes 10000 100000 1000000 --dim 256 --baseline results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'zhiznmart_questions.json')
+RECALL_AT = (1, 3, 5)
+
+
+def normalize_text(text):
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def peak_rss_mib():
+    """Peak resident set size of the process (ru_maxrss is in KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def index_mib(index):
+    """Memory held by the index arrays: embeddings, BM25 weights and vector index extras."""
+    matrix = index.bm25.matrix
+    total = index.embeddings.nbytes + matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    for name in ('codes', 'ids', 'centroids', 'codebooks'):
+        array = getattr(index.vector_index, name, None)
+        if isinstance(array, np.ndarray):
+            total += array.nbytes
+    return total / 2 ** 20
+
+
+def evaluate_quality(service, questions, alpha):
+    """recall@k and MRR of fusion_retrieval against the labeled answer phrases."""
+    depth = max(RECALL_AT)
+    hits = {k: 0 for k in RECALL_AT}
+    reciprocal_ranks = []
+    for item in questions:
+        documents = service.fusion_retrieval(item['question'], k=depth, alpha=alpha)
+        answer = normalize_text(item['answer'])
+        rank = next((position for position, document in enumerate(documents, 1)
+                     if answer in normalize_text(document.page_content)), None)
+        for k in RECALL_AT:
+            hits[k] += rank is not None and rank <= k
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    result = {f'recall@{k}': hits[k] / len(questions) for k in RECALL_AT}
+    result['mrr'] = float(np.mean(reciprocal_ranks))
+    return result
+
+
+def synthetic_index(n_docs, dim, words, doc_words=40, seed=0):
+    """KnowledgeIndex over n_docs synthetic chunks: Zipf-sampled words and clustered random embeddings."""
+    from langchain.docstore.document import Document
+
+    from RAG.bm25 import SparseBM25, stem_russian
+    from RAG.rag import EMBEDDING_DTYPE, KnowledgeIndex
+    from RAG.vector_index import QuantizedVectors, create_vector_index, normalize_rows
+
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(words)
+    stems = np.array([stem_russian(normalize_text(word).strip('.,:;!?«»()—-')) for word in words])
+    cdf = np.cumsum(1.0 / np.arange(1, len(words) + 1))
+    cdf /= cdf[-1]
+
+    documents = []
+
+    def corpus():
+        # Token lists are streamed into BM25 and never held for the whole corpus
+        for start in range(0, n_docs, 65536):
+            block = np.searchsorted(cdf, rng.random((min(65536, n_docs - start), doc_words)))
+            for ids in block:
+                documents.append(Document(page_content=' '.join(vocabulary[ids])))
+                yield stems[ids].tolist()
+
+    bm25 = SparseBM25(corpus())
+
+    # Embeddings are generated in blocks to avoid a float64 copy of the whole corpus
+    centers = rng.normal(size=(max(1, n_docs // 100), dim)).astype(np.float32)
+    matrix = np.empty((n_docs, dim), dtype=np.float32)
+    for start in range(0, n_docs, 65536):
+        rows = min(65536, n_docs - start)
+        block = centers[rng.integers(0, len(centers), rows)] + 0.5 * rng.standard_normal((rows, dim), np.float32)
+        matrix[start:start + rows] = normalize_rows(block)
+    embeddings = QuantizedVectors(matrix, EMBEDDING_DTYPE)
+    del matrix
+
+    vector_index = create_vector_index()
+    vector_index.build(embeddings)
+    return KnowledgeIndex(documents, embeddings, vector_index, bm25, version=f'synthetic-{n_docs}')
+
+
+def measure_scale(service, n_docs, args, words):
+    start = time.perf_counter()
+    index = synthetic_index(n_docs, args.dim, words)
+    build_seconds = time.perf_counter() - start
+    service.index = index
+
+    rng = np.random.default_rng(n_docs)
+    queries = [' '.join(rng.choice(words, 6)) for _ in range(args.queries)]
+    service.fusion_retrieval(queries[0], k=args.k, alpha=args.alpha)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        service.fusion_retrieval(query, k=args.k, alpha=args.alpha)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        'docs': n_docs,
+        'build_s': build_seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'index_mib': index_mib(index),
+        'peak_rss_mib': peak_rss_mib(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints differences with a previous run; returns False on a quality regression."""
+    ok = True
+    previous = {item['strategy']: item for item in baseline.get('quality', [])}
+    for item in results['quality']:
+        before = previous.get(item['strategy'])
+        if before is None:
+            continue
+        for metric in [f'recall@{k}' for k in RECALL_AT] + ['mrr']:
+            delta = item[metric] - before[metric]
+            regressed = delta < -tolerance
+            ok = ok and not regressed
+            print(f"{item['strategy']:<9} {metric:<9} {before[metric]:.3f} -> {item[metric]:.3f} "
+                  f"({delta:+.3f}){'  REGRESSION' if regressed else ''}", file=sys.stderr)
+    previous = {item['docs']: item for item in baseline.get('scale', [])}
+    for item in results['scale']:
+        before = previous.get(item['docs'])
+        if before is not None:
+            print(f"docs={item['docs']:<8} p50 {before['p50_ms']:.2f} -> {item['p50_ms']:.2f} ms, "
+                  f"index {before['index_mib']:.1f} -> {item['index_mib']:.1f} MiB", file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="data.txt", help="knowledge base file or directory")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="labeled questions (JSON)")
+    parser.add_argument("--chunk-size", type=int, default=200,
+                        help="chunk size in tokens; smaller than the bot's default to make the set discriminative")
+    parser.add_argument("--strategies", nargs="+", default=None, help="fusion strategies to evaluate")
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="synthetic corpus sizes; up to 1000000")
+    parser.add_argument("--dim", type=int, default=256, help="embedding dimension of the synthetic corpora")
+    parser.add_argument("--queries", type=int, default=100, help="queries per corpus size")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed drop of recall/MRR")
+    args = parser.parse_args()
+
+    # The suite must not touch the bot's index directory or caches; modules read these at import
+    workdir = tempfile.mkdtemp(prefix='rag-bench-')
+    os.environ['KNOWLEDGE_BASE_PATH'] = args.source
+    os.environ['CHUNK_SIZE'] = str(args.chunk_size)
+    os.environ['RAG_INDEX_DIR'] = os.path.join(workdir, 'index')
+    os.environ['KB_ARTIFACT_PATH'] = os.path.join(workdir, 'kb_artifact.bin')
+    os.environ['QUERY_CACHE_PATH'] = ''
+    os.environ['KB_WATCH_INTERVAL'] = '0'
+
+    from RAG.benchmarks.fake_backend import FakeEmbeddingService
+    from RAG.fusion import FUSION_STRATEGIES, FUSION_STRATEGY, create_fusion_strategy
+    from RAG.rag import EMBEDDING_DTYPE
+    from RAG.vector_index import VECTOR_INDEX
+
+    with open(args.questions, 'r', encoding='utf-8') as file:
+        questions = json.load(file)
+    strategies = args.strategies or list(FUSION_STRATEGIES)
+
+    # Indexing progress is printed to stdout, which may carry the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        service = FakeEmbeddingService()
+    results = {
+        'suite': 'retrieval',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {
+            'backend': 'fake-trigram',
+            'vector_index': VECTOR_INDEX,
+            'embedding_dtype': EMBEDDING_DTYPE.name,
+            'default_fusion': FUSION_STRATEGY,
+            'alpha': args.alpha,
+            'k': args.k,
+            'dim': args.dim,
+            'chunk_size': args.chunk_size,
+            'chunks': len(service.index.documents),
+            'questions': len(questions),
+        },
+        'quality': [],
+        'scale': [],
+    }
+    for name in strategies:
+        service.fusion_strategy = create_fusion_strategy(name)
+        results['quality'].append({'strategy': name, **evaluate_quality(service, questions, args.alpha)})
+        print(f"quality {name:<9} " + "  ".join(
+            f"{metric}={value:.3f}" for metric, value in results['quality'][-1].items() if metric != 'strategy'
+        ), file=sys.stderr)
+
+    with open(args.source if os.path.isfile(args.source) else os.devnull, 'r', encoding='utf-8') as file:
+        words = list(dict.fromkeys(file.read().split())) or ['жизньмарт']
+    service.fusion_strategy = create_fusion_strategy()
+    FakeEmbeddingService.dim = args.dim
+    for n_docs in args.sizes:
+        results['scale'].append(measure_scale(service, n_docs, args, words))
+        item = results['scale'][-1]
+        print(f"scale   docs={n_docs:<8} build={item['build_s']:.1f} s  p50={item['p50_ms']:.2f} ms  "
+              f"p99={item['p99_ms']:.2f} ms  index={item['index_mib']:.1f} MiB  "
+              f"peak rss={item['peak_rss_mib']:.0f} MiB", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
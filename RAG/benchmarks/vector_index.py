@@ -0,0 +1,92 @@
+"""Benchmark: IVF-PQ approximate search vs. exact search (recall@k and per-query latency).
+
+Uses a synthetic clustered corpus of unit vectors, so it runs offline.
+
+Usage:
+    python -m RAG.benchmarks.vector_index --docs 100000 --dim 256 --nprobe 4 8 16
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from RAG.vector_index import ExactIndex, IVFPQIndex, normalize_rows
+
+
+def synthetic_corpus(n_docs, dim, n_queries, seed=0):
+    """Clustered unit vectors plus queries that are noisy copies of corpus vectors."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n_docs // 100), dim))
+    docs = centers[rng.integers(0, len(centers), n_docs)] + 0.5 * rng.normal(size=(n_docs, dim))
+    queries = docs[rng.integers(0, n_docs, n_queries)] + 0.3 * rng.normal(size=(n_queries, dim))
+    return normalize_rows(docs), normalize_rows(queries)
+
+
+def timed_search(index, queries, k):
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, row_ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(row_ids[0])
+    return np.stack(ids), np.array(latencies)
+
+
+def recall_at_k(truth, found):
+    return float(np.mean([len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 64])
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    docs, queries = synthetic_corpus(args.docs, args.dim, args.queries)
+
+    exact = ExactIndex()
+    exact.build(docs)
+    truth, exact_latency = timed_search(exact, queries, args.k)
+
+    ivfpq = IVFPQIndex(nlist=args.nlist, m=args.m)
+    start = time.perf_counter()
+    ivfpq.build(docs)
+    build_seconds = time.perf_counter() - start
+
+    results = [{
+        "index": "exact", "recall": 1.0,
+        "p50_ms": float(np.percentile(exact_latency, 50)), "p99_ms": float(np.percentile(exact_latency, 99)),
+    }]
+    for nprobe in args.nprobe:
+        for rerank in args.rerank:
+            ivfpq.nprobe, ivfpq.rerank = nprobe, rerank
+            found, latency = timed_search(ivfpq, queries, args.k)
+            results.append({
+                "index": "ivfpq", "nprobe": nprobe, "rerank": rerank,
+                "recall": recall_at_k(truth, found),
+                "p50_ms": float(np.percentile(latency, 50)), "p99_ms": float(np.percentile(latency, 99)),
+            })
+
+    if args.json:
+        for result in results:
+            print(json.dumps({"docs": args.docs, "dim": args.dim, "k": args.k, **result}))
+        return
+
+    print(f"corpus: {args.docs} x {args.dim}, IVF-PQ build {build_seconds:.1f} s, "
+          f"{len(ivfpq.centroids)} lists, m={ivfpq.codebooks.shape[0]}")
+    for result in results:
+        params = f"nprobe={result['nprobe']:<3} rerank={result['rerank']:<3}" if result["index"] == "ivfpq" else ""
+        print(f"{result['index']:<6} {params:<22} recall@{args.k}={result['recall']:.3f}  "
+              f"p50={result['p50_ms']:.3f} ms  p99={result['p99_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
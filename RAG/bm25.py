@@ -0,0 +1,147 @@
+import re
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+_WORD = re.compile(r'\w+')
+
+# Стеммер Портера (Snowball) для русского языка
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|'
+                   r'ыть|ишь|ую|ю)|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$')
+_NOUN = re.compile(r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|'
+                   r'ия|ья|я)$')
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DERIVATIONAL_SUFFIX = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_I = re.compile(r'и$')
+_SOFT_SIGN = re.compile(r'ь$')
+_DOUBLE_N = re.compile(r'нн$')
+
+
+@lru_cache(maxsize=200000)
+def stem_russian(word: str) -> str:
+    """Основа русского слова; слова без кириллицы возвращаются как есть"""
+    match = _RV.match(word)
+    if match is None:
+        return word
+    prefix, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    rv = _I.sub('', rv, 1)
+    if _DERIVATIONAL.match(rv):
+        rv = _DERIVATIONAL_SUFFIX.sub('', rv, 1)
+
+    stripped = _SOFT_SIGN.sub('', rv, 1)
+    if stripped == rv:
+        rv = _DOUBLE_N.sub('н', _SUPERLATIVE.sub('', rv, 1), 1)
+    else:
+        rv = stripped
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Токенизация для BM25, одинаковая для документов и запросов:
+    нижний регистр, ё -> е, без пунктуации, русские слова приводятся к основе
+    """
+    return [stem_russian(word) for word in _WORD.findall(text.lower().replace('ё', 'е'))]
+
+
+class SparseBM25:
+    """
+    BM25 на разреженной матрице документ x термин (CSC) с заранее посчитанными весами
+    idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avg_len)).
+    Оценка запроса - сумма столбцов его терминов, т.е. одно разреженное умножение на весь корпус.
+    """
+
+    def __init__(self, corpus: Iterable[Sequence[str]] = (), k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        # Типизированные массивы вместо списков: корпус можно подавать генератором без лишней памяти
+        rows, cols, counts, lengths = array('i'), array('i'), array('f'), array('f')
+        for doc_id, tokens in enumerate(corpus):
+            lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                rows.append(doc_id)
+                cols.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                counts.append(count)
+
+        doc_lengths = np.frombuffer(lengths, dtype=np.float32)
+        self.doc_count = len(doc_lengths)
+        tf = sparse.csc_matrix(
+            (np.frombuffer(counts, dtype=np.float32),
+             (np.frombuffer(rows, dtype=np.int32), np.frombuffer(cols, dtype=np.int32))),
+            shape=(self.doc_count, len(self.vocabulary))
+        )
+        self.avg_doc_length = float(doc_lengths.mean()) if self.doc_count else 0.0
+        self.doc_freq = np.diff(tf.indptr).astype(np.float32)
+        # Вариант idf без отрицательных значений: термин из половины корпуса не обнуляет оценку
+        self.idf = np.log1p((self.doc_count - self.doc_freq + 0.5) / (self.doc_freq + 0.5)).astype(np.float32)
+
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / (self.avg_doc_length or 1))
+        tf.data = (tf.data * (self.k1 + 1) / (tf.data + length_norm[tf.indices])
+                   * np.repeat(self.idf, np.diff(tf.indptr)))
+        self.matrix = tf
+
+    def to_arrays(self) -> Tuple[dict, Dict[str, np.ndarray]]:
+        """Статистика индекса для сохранения: (параметры и словарь, массивы матрицы весов)"""
+        params = {
+            'k1': self.k1,
+            'b': self.b,
+            'doc_count': self.doc_count,
+            'avg_doc_length': self.avg_doc_length,
+            'vocabulary': list(self.vocabulary),
+        }
+        arrays = {
+            'weights': self.matrix.data,
+            'indices': self.matrix.indices,
+            'indptr': self.matrix.indptr,
+            'idf': self.idf,
+            'doc_freq': self.doc_freq,
+        }
+        return params, arrays
+
+    @classmethod
+    def from_arrays(cls, params: dict, arrays: Dict[str, np.ndarray]) -> 'SparseBM25':
+        """Индекс из сохранённой статистики без повторной токенизации корпуса"""
+        bm25 = cls(k1=params['k1'], b=params['b'])
+        bm25.vocabulary = {term: term_id for term_id, term in enumerate(params['vocabulary'])}
+        bm25.doc_count = params['doc_count']
+        bm25.avg_doc_length = params['avg_doc_length']
+        bm25.idf = arrays['idf']
+        bm25.doc_freq = arrays['doc_freq']
+        bm25.matrix = sparse.csc_matrix(
+            (arrays['weights'], arrays['indices'], arrays['indptr']),
+            shape=(bm25.doc_count, len(bm25.vocabulary))
+        )
+        return bm25
+
+    def get_scores(self, query: Sequence[str]) -> np.ndarray:
+        """Оценки BM25 всех документов для токенизированного запроса"""
+        term_counts = Counter(self.vocabulary[term] for term in query if term in self.vocabulary)
+        if not term_counts:
+            return np.zeros(self.doc_count, dtype=np.float32)
+        term_ids = np.fromiter(term_counts.keys(), dtype=np.int64)
+        counts = np.fromiter(term_counts.values(), dtype=np.float32)
+        return np.asarray(self.matrix[:, term_ids] @ counts).ravel()
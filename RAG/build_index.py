@@ -0,0 +1,58 @@
+"""Offline build of the knowledge base index artifact.
+
+Chunks the knowledge base, embeds new chunks (reusing the embedding store), builds BM25 and
+writes everything into a single versioned file. At startup the bot memory-maps that file
+instead of indexing the sources, as long as the model and the source files are unchanged.
+
+Usage:
+    python -m RAG.build_index [--source data.txt] [--output rag_index/kb_artifact.bin] [--dtype int8]
+    python -m RAG.build_index --info
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="knowledge base file or directory (KNOWLEDGE_BASE_PATH)")
+    parser.add_argument("--output", help="artifact path (KB_ARTIFACT_PATH)")
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], help="embedding storage (EMBEDDING_DTYPE)")
+    parser.add_argument("--info", action="store_true", help="print the header of an existing artifact and exit")
+    args = parser.parse_args()
+
+    # Модули RAG читают настройки из окружения при импорте
+    for env, value in (("KNOWLEDGE_BASE_PATH", args.source), ("KB_ARTIFACT_PATH", args.output),
+                       ("EMBEDDING_DTYPE", args.dtype)):
+        if value:
+            os.environ[env] = value
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    from RAG.artifact import KB_ARTIFACT_PATH, read_artifact_header
+
+    if args.info:
+        header = read_artifact_header(KB_ARTIFACT_PATH)
+        if header is None:
+            print(f"No readable artifact at {KB_ARTIFACT_PATH}")
+            sys.exit(1)
+        print(f"{KB_ARTIFACT_PATH}: format {header['format_version']}, version {header['version']}")
+        print(f"built {header['created_at']} with {header['model']}, {header['dtype']} x {header['dim']}")
+        print(f"{len(header['chunks'])} chunks from {len(header['sources'])} file(s), "
+              f"chunk size {header['chunk_size']}, overlap {header['chunk_overlap']}")
+        return
+
+    from RAG.rag import EmbeddingService
+
+    start = time.perf_counter()
+    service = EmbeddingService(use_artifact=False)
+    header = service.save_artifact(KB_ARTIFACT_PATH)
+    size = os.path.getsize(KB_ARTIFACT_PATH)
+    print(f"Wrote {KB_ARTIFACT_PATH} ({size / 2 ** 20:.1f} MiB) in {time.perf_counter() - start:.1f} s: "
+          f"{len(header['chunks'])} chunks, {header['model']} {header['dtype']} x {header['dim']}, "
+          f"version {header['version'][:12]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,57 @@
+import threading
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
 from langgraph.graph import END, StateGraph
 
+from RAG.answer_cache import SemanticAnswerCache
+from RAG.grader_cache import grader_cache
+from RAG.graph_metrics import graph_metrics
 from RAG.graph_ai import GraphState, retrieve, grade_documents, generate, \
     grade_generation_vs_documents_and_question, decide_to_generate, transform_query, send_sorry_message, \
-    decide_to_transform_query, transformation_count_increment
+    decide_to_transform_query, transformation_count_increment, embedding_service, adaptive_grade_documents, \
+    adaptive_grade_generation
+from RAG.fast_path import FastPathPolicy
 from openai_helper import OpenAIHelper
 import asyncio
 
 
 import logging
+import os
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-async def run_graph(openai: OpenAIHelper, chat_id: int, question):
-    """Execute the RAG workflow graph asynchronously.
-    
+# Pipeline used by run_graph: "default" grades every request, "adaptive" skips graders on confident retrieval
+DEFAULT_PIPELINE = os.environ.get("RAG_PIPELINE", "default")
+
+
+async def async_generate_wrapper(state):
+    """Async wrapper for the generate function that uses the existing event loop"""
+    try:
+        return await generate(state)
+    except Exception as e:
+        logger.error(f"Error in generate: {str(e)}")
+        raise
+
+
+def build_workflow(grade_documents_node: Callable = grade_documents,
+                   grade_generation_edge: Callable = grade_generation_vs_documents_and_question) -> StateGraph:
+    """Build the (uncompiled) RAG workflow graph.
+
     Args:
-        openai: OpenAI helper instance
-        chat_id: Telegram chat ID
-        question: User's question
-        
+        grade_documents_node: Node that filters the retrieved documents
+        grade_generation_edge: Edge that checks the generation against the documents and the question
+
     Returns:
-        tuple: (final_generation, total_tokens)
+        StateGraph: graph with all nodes and edges of the RAG pipeline
     """
-    # Create an async wrapper for the generate function
-    async def async_generate_wrapper(state):
-        """Async wrapper for the generate function that uses the existing event loop"""
-        try:
-            return await generate(state)
-        except Exception as e:
-            logger.error(f"Error in generate: {str(e)}")
-            raise
-
     workflow = StateGraph(GraphState)
 
     # Define the nodes
     # Add nodes to the workflow
     workflow.add_node("retrieve", retrieve)
-    workflow.add_node("grade_documents", grade_documents)
+    workflow.add_node("grade_documents", grade_documents_node)
     workflow.add_node("generate", async_generate_wrapper)
     workflow.add_node("transform_query", transform_query)
     workflow.add_node("send_sorry_message", send_sorry_message)
@@ -56,7 +70,7 @@ async def run_graph(openai: OpenAIHelper, chat_id: int, question):
     )
     workflow.add_conditional_edges(
         "generate",
-        grade_generation_vs_documents_and_question,
+        grade_generation_edge,
         {
             "not supported": "generate",
             "useful": END,
@@ -74,9 +88,154 @@ async def run_graph(openai: OpenAIHelper, chat_id: int, question):
     workflow.add_edge("transform_query", "retrieve")
     workflow.add_edge("send_sorry_message", END)
 
-    # Compile
-    app = workflow.compile()
-    from pprint import pprint
+    return workflow
+
+
+def build_adaptive_workflow() -> StateGraph:
+    """Build the RAG workflow that skips LLM grading when retrieval confidence clears calibrated thresholds.
+
+    Thresholds come from ``python -m RAG.calibrate_fast_path``; without them the graph behaves like the default one.
+
+    Returns:
+        StateGraph: graph with the adaptive grading node and edge
+    """
+    policy = FastPathPolicy.load()
+    return build_workflow(adaptive_grade_documents(policy), adaptive_grade_generation(policy))
+
+
+class GraphRegistry:
+    """Registry of compiled RAG graphs shared by all chat handlers.
+
+    Every pipeline is registered under a name together with a builder that returns
+    an uncompiled ``StateGraph``. The graph is compiled once (lazily on first use or
+    eagerly via ``warm_up``) and the compiled app is reused for every request.
+    """
+
+    def __init__(self):
+        self._builders: Dict[str, Callable[[], StateGraph]] = {}
+        self._compiled: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, builder: Callable[[], StateGraph]):
+        """Register a pipeline builder. A previously compiled graph with the same name is dropped.
+
+        Args:
+            name: Pipeline name
+            builder: Callable returning an uncompiled StateGraph
+        """
+        with self._lock:
+            self._builders[name] = builder
+            self._compiled.pop(name, None)
+
+    def get(self, name: str = DEFAULT_PIPELINE):
+        """Return the compiled graph for the pipeline, compiling it on first use.
+
+        Args:
+            name: Pipeline name
+
+        Returns:
+            CompiledStateGraph: compiled graph ready for ``astream``/``ainvoke``
+        """
+        app = self._compiled.get(name)
+        if app is not None:
+            return app
+        with self._lock:
+            app = self._compiled.get(name)
+            if app is None:
+                app = self._compile(name)
+                self._compiled[name] = app
+            return app
+
+    def rebuild(self, name: Optional[str] = None):
+        """Recompile one pipeline (or all registered pipelines) after a configuration change.
+
+        The new app replaces the old one atomically, so requests that already hold
+        a reference to the previous graph finish on it undisturbed.
+
+        Args:
+            name: Pipeline name, or None to rebuild every registered pipeline
+        """
+        names = [name] if name is not None else list(self._builders)
+        for pipeline in names:
+            app = self._compile(pipeline)
+            with self._lock:
+                self._compiled[pipeline] = app
+            logger.info(f"Pipeline '{pipeline}' recompiled")
+
+    def warm_up(self):
+        """Compile every registered pipeline ahead of the first request."""
+        for name in list(self._builders):
+            self.get(name)
+
+    def _compile(self, name: str):
+        if name not in self._builders:
+            raise KeyError(f"Unknown RAG pipeline '{name}'")
+        return self._builders[name]().compile()
+
+
+graph_registry = GraphRegistry()
+graph_registry.register("default", build_workflow)
+graph_registry.register("adaptive", build_adaptive_workflow)
+
+# Answers to semantically equal questions are reused until the knowledge base changes
+answer_cache = SemanticAnswerCache()
+
+# Cache counters are reported by /rag_stats and the periodic graph summary
+graph_metrics.register_cache("query_embeddings", embedding_service.query_cache.stats)
+graph_metrics.register_cache("answers", answer_cache.stats)
+graph_metrics.register_cache("grader_verdicts", grader_cache.stats)
+
+
+async def lookup_cached_answer(question: str):
+    """Look the question up in the semantic answer cache.
+
+    Args:
+        question: User's question
+
+    Returns:
+        tuple: (cached answer or None, question embedding or None, knowledge base version)
+    """
+    kb_version = embedding_service.index.version
+    try:
+        # The embedding lands in the query cache, so the retrieve node does not request it again
+        embedding = await embedding_service.aembed_query(question)
+    except Exception as e:
+        logger.warning(f"Answer cache lookup skipped, could not embed the question: {str(e)}")
+        return None, None, kb_version
+    return answer_cache.get(question, embedding, kb_version), embedding, kb_version
+
+
+async def run_graph(openai: OpenAIHelper, chat_id: int, question, pipeline: str = DEFAULT_PIPELINE,
+                    use_cache: bool = True, on_draft: Optional[Callable[[str], Awaitable[None]]] = None):
+    """Execute the RAG workflow graph asynchronously.
+
+    A semantically equal question answered before for the same knowledge base version is served
+    from ``answer_cache`` without running the graph; only answers accepted by the graders are cached.
+    The cache is shared by all chats and keyed on the question alone, so it is used only on the first
+    turn of a conversation: later questions are answered with the chat history and may refer to it.
+
+    Args:
+        openai: OpenAI helper instance
+        chat_id: Telegram chat ID
+        question: User's question
+        pipeline: Name of the compiled pipeline in ``graph_registry``
+        use_cache: Consult and fill the semantic answer cache (first turn of a conversation only)
+        on_draft: Async callback receiving the generation draft while it streams. The returned
+            answer is final: it may differ from the last draft if the graders rejected it
+
+    Returns:
+        tuple: (final_generation, total_tokens)
+    """
+    app = graph_registry.get(pipeline)
+
+    embedding, kb_version = None, None
+    if use_cache and answer_cache.enabled and not openai.has_history(chat_id):
+        cached, embedding, kb_version = await lookup_cached_answer(question)
+        if cached is not None:
+            # Keep the conversation coherent for follow-up questions
+            openai.add_to_history(chat_id, role="user", content=question)
+            openai.add_to_history(chat_id, role="assistant", content=cached)
+            return cached, 0
 
     try:
         # Prepare input state
@@ -86,22 +245,41 @@ async def run_graph(openai: OpenAIHelper, chat_id: int, question):
             "transformation_count": 0,
             "openai_helper": openai,
             "chat_id": chat_id,
-            "total_tokens": 0
+            "total_tokens": 0,
+            "on_draft": on_draft,
+            # Ties the grader verdict log records of this request together
+            "request_id": uuid.uuid4().hex
         }
-        
+
         # Run the graph asynchronously
         logger.info(f"Starting graph execution for chat_id {chat_id}")
-        async for output in app.astream(inputs):
+        trace = graph_metrics.trace()
+        async for output in app.astream(inputs, config={"callbacks": [trace]}):
             for key, value in output.items():
                 logger.debug(f"Completed node '{key}'")
-        
+                if key == "generate":
+                    # The generation goes through OpenAIHelper, not LangChain, so the callback does not see it
+                    trace.add_llm_call(key, total_tokens=int(value.get("total_tokens") or 0))
+        graph_metrics.record(trace, pipeline)
+
         # Extract final results
         final_generation = value.get("generation")
         total_tokens = value.get("total_tokens", 0)
-        
+
+        # The graph ends on "generate" only when the answer passed the hallucination and answer graders
+        # (or the calibrated fast path of the adaptive pipeline)
+        if embedding is not None and key == "generate" and final_generation:
+            answer_cache.put(question, embedding, kb_version, final_generation)
+
+        # History keeps the user's question and the final answer only, without the retrieved context
+        # and the drafts rejected by the graders
+        if isinstance(final_generation, str):
+            openai.add_to_history(chat_id, role="user", content=question)
+            openai.add_to_history(chat_id, role="assistant", content=final_generation)
+
         logger.info(f"Graph execution completed for chat_id {chat_id}")
         return final_generation, total_tokens
-        
+
     except Exception as e:
         logger.error(f"Error in graph execution: {str(e)}")
         raise
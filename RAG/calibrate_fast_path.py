@@ -0,0 +1,137 @@
+"""Calibration of the adaptive pipeline fast path from logged grader verdicts.
+
+The bot logs every grader verdict together with the retrieval confidence of the request when
+GRADER_VERDICT_LOG is set. For each fast path decision this tool finds the lowest threshold on a
+confidence metric above which the graders almost always agreed with skipping them:
+
+* skip_document_grading: the relevance grader found every chunk it judged relevant (chunks
+  skipped by GRADER_STOP_AFTER_RELEVANT or left without a verdict do not count);
+* skip_generation_grading: the first answer of the request was grounded and addressed the
+  question (the retries after a "not supported" verdict are not separate samples).
+
+"Almost always" means the lower Wilson bound of that rate is at least --target, over at least
+--min-support logged requests. Decisions without such a threshold are left out, so the
+adaptive pipeline keeps grading those requests.
+
+Usage:
+    GRADER_VERDICT_LOG=rag_index/grader_verdicts.jsonl python main.py   # collect verdicts
+    python -m RAG.calibrate_fast_path --log rag_index/grader_verdicts.jsonl --target 0.95
+    RAG_PIPELINE=adaptive python main.py
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+METRICS = ("top_cosine", "mean_cosine")
+
+
+def wilson_lower_bound(successes: int, total: int, z: float = 1.96) -> float:
+    if not total:
+        return 0.0
+    rate = successes / total
+    denominator = 1 + z * z / total
+    center = rate + z * z / (2 * total)
+    margin = z * math.sqrt(rate * (1 - rate) / total + z * z / (4 * total * total))
+    return (center - margin) / denominator
+
+
+def read_samples(path):
+    """(confidence, fast path would have been right) pairs for each decision."""
+    from RAG.fast_path import SKIP_DOCUMENT_GRADING, SKIP_GENERATION_GRADING
+
+    samples = {SKIP_DOCUMENT_GRADING: [], SKIP_GENERATION_GRADING: []}
+    answered = set()
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('kind') == 'documents' and record.get('graded'):
+                samples[SKIP_DOCUMENT_GRADING].append(
+                    (record['confidence'], record['relevant'] == record['graded']))
+            elif record.get('kind') == 'generation':
+                # The fast path would have accepted the first generation of the request
+                request_id = record.get('request_id')
+                if request_id is not None:
+                    if request_id in answered:
+                        continue
+                    answered.add(request_id)
+                samples[SKIP_GENERATION_GRADING].append((record['confidence'], record.get('useful') is True))
+    return samples
+
+
+def calibrate(samples, target, min_support, z=1.96):
+    """Lowest threshold per metric meeting the target; returns the rule with the largest coverage or None."""
+    best = None
+    for metric in METRICS:
+        points = sorted(((confidence[metric], ok) for confidence, ok in samples if metric in confidence),
+                        reverse=True)
+        successes = 0
+        for covered, (value, ok) in enumerate(points, 1):
+            successes += ok
+            # Only cut between distinct values, every request at the threshold is covered
+            if covered < len(points) and points[covered][0] == value:
+                continue
+            if covered >= min_support and wilson_lower_bound(successes, covered, z) >= target:
+                if best is None or covered > best['support']:
+                    best = {
+                        'metric': metric,
+                        'threshold': value,
+                        'support': covered,
+                        'precision': successes / covered,
+                        'coverage': covered / len(samples),
+                    }
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=os.environ.get('GRADER_VERDICT_LOG'), help="grader verdict log (JSON lines)")
+    parser.add_argument("--output", help="thresholds file (FAST_PATH_THRESHOLDS_PATH)")
+    parser.add_argument("--target", type=float, default=0.95,
+                        help="required lower bound of the rate at which the graders agree with skipping them")
+    parser.add_argument("--min-support", type=int, default=50, help="minimum logged requests above the threshold")
+    parser.add_argument("--z", type=float, default=1.96, help="z-score of the Wilson bound")
+    parser.add_argument("--dry-run", action="store_true", help="print the thresholds without writing them")
+    args = parser.parse_args()
+
+    if not args.log or not os.path.exists(args.log):
+        print(f"No grader verdict log at {args.log!r}; run the bot with GRADER_VERDICT_LOG set first")
+        sys.exit(1)
+    if args.output:
+        os.environ['FAST_PATH_THRESHOLDS_PATH'] = args.output
+    from RAG.fast_path import FAST_PATH_THRESHOLDS_PATH
+
+    thresholds = {}
+    for decision, samples in read_samples(args.log).items():
+        rule = calibrate(samples, args.target, args.min_support, args.z)
+        if rule is None:
+            print(f"{decision}: no threshold meets the target over {len(samples)} logged requests")
+            continue
+        thresholds[decision] = rule
+        print(f"{decision}: {rule['metric']} >= {rule['threshold']:.4f} covers {rule['coverage']:.1%} "
+              f"of {len(samples)} requests, graders agreed in {rule['precision']:.1%}")
+
+    if args.dry_run:
+        return
+    result = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'log': args.log,
+        'target': args.target,
+        'min_support': args.min_support,
+        'thresholds': thresholds,
+    }
+    directory = os.path.dirname(FAST_PATH_THRESHOLDS_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(FAST_PATH_THRESHOLDS_PATH, 'w', encoding='utf-8') as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    print(f"Wrote {FAST_PATH_THRESHOLDS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
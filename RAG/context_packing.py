@@ -0,0 +1,119 @@
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document
+
+# Бюджет контекста в промпте генерации, токены cl100k_base; 0 - без ограничения
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3000))
+
+# Минимальная длина совпадения конца чанка с началом следующего, которое считается оверлапом нарезки
+OVERLAP_MIN_CHARS = 16
+# Токены на номер отрывка и разделитель между отрывками
+PASSAGE_OVERHEAD_TOKENS = 4
+
+
+def chunk_position(document: Document) -> Optional[Tuple[str, int]]:
+    """(источник, номер чанка) из metadata['chunk_id'] вида 'name#index'"""
+    name, _, index = str(document.metadata.get('chunk_id', '')).rpartition('#')
+    if not name or not index.isdigit():
+        return None
+    return name, int(index)
+
+
+def overlap_length(left: str, right: str, min_chars: int = OVERLAP_MIN_CHARS) -> int:
+    """Длина самого длинного конца left, которым начинается right (не короче min_chars), иначе 0"""
+    if min(len(left), len(right)) < min_chars:
+        return 0
+    head = right[:min_chars]
+    start = left.find(head, max(len(left) - len(right), 0))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(head, start + 1)
+    return 0
+
+
+class Passage:
+    """Подряд идущие чанки одного источника, склеенные без повторов оверлапа"""
+
+    def __init__(self, position: Optional[Tuple[str, int]], text: str, tokens: float, rank: int):
+        self.source, self.first = position if position else (None, None)
+        self.last = self.first
+        self.text = text
+        self.tokens = tokens
+        self.rank = rank
+
+    def join(self, following: 'Passage', overlap: int) -> 'Passage':
+        """Дописывает следующий по порядку отрывок, отбрасывая overlap символов его начала"""
+        self.text = self.text + following.text[overlap:] if overlap else f'{self.text}\n{following.text}'
+        self.last = following.last
+        self.tokens += following.tokens
+        self.rank = min(self.rank, following.rank)
+        return self
+
+
+class PackedContext:
+    """Результат упаковки: текст контекста и сколько чанков и токенов в него вошло"""
+
+    def __init__(self, text: str, tokens: int, packed: int, dropped: int, overlap_tokens: int):
+        self.text = text
+        self.tokens = tokens
+        self.packed = packed
+        self.dropped = dropped
+        self.overlap_tokens = overlap_tokens
+
+    def __str__(self):
+        return self.text
+
+
+def pack_context(documents: Sequence[Document], token_counts: Sequence[int],
+                 budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """
+    Упаковывает чанки в порядке ранжирования, пока они помещаются в бюджет токенов.
+    Соседние чанки одного источника склеиваются в один отрывок, повтор оверлапа на стыке выбрасывается;
+    чанк, не поместившийся целиком, пропускается, а следующие (короче) ещё могут поместиться.
+    Число токенов обрезанного чанка оценивается пропорционально длине по готовому числу токенов всего чанка.
+    Отрывки выводятся как '[n] текст' без метаданных в порядке лучшего чанка в каждом.
+    """
+    passages: List[Passage] = []
+    used = 0.0
+    packed = dropped = 0
+    overlap_tokens = 0.0
+    for rank, (document, count) in enumerate(zip(documents, token_counts)):
+        text = document.page_content
+        if not text:
+            continue
+        position = chunk_position(document)
+        left = right = None
+        if position is not None:
+            source, index = position
+            left = next((p for p in passages if p.source == source and p.last == index - 1), None)
+            right = next((p for p in passages if p.source == source and p.first == index + 1), None)
+        head = overlap_length(left.text, text) if left else 0
+        tail = overlap_length(text, right.text) if right else 0
+        tokens = count * max(len(text) - head - tail, 0) / len(text)
+        # Присоединение к соседям убирает один отрывок, отдельный чанк добавляет новый
+        overhead = PASSAGE_OVERHEAD_TOKENS * (1 - bool(left) - bool(right))
+        if budget and used + tokens + overhead > budget:
+            if passages or overhead >= budget:
+                dropped += 1
+                continue
+            # Лучший чанк больше всего бюджета: берём его начало, чтобы контекст не остался пустым
+            text = text[:int(len(text) * (budget - overhead) / count)]
+            tokens = budget - overhead
+        packed += 1
+        used += tokens + overhead
+        overlap_tokens += count * (head + tail) / len(document.page_content)
+
+        passage = Passage(position, text, tokens, rank)
+        if left is not None:
+            passage = left.join(passage, head)
+        else:
+            passages.append(passage)
+        if right is not None:
+            passages.remove(right)
+            passage.join(right, tail)
+
+    passages.sort(key=lambda p: p.rank)
+    text = '\n\n'.join(f'[{number}] {passage.text.strip()}' for number, passage in enumerate(passages, 1))
+    return PackedContext(text, round(used), packed, dropped, round(overlap_tokens))
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Версия формата артефакта: при несовместимых изменениях увеличиваем, старые файлы пересобираются
+STORE_FORMAT_VERSION = 1
+
+RAG_INDEX_DIR = os.environ.get('RAG_INDEX_DIR', 'rag_index')
+# По умолчанию sha256 матрицы сверяется при каждой загрузке. 0 - доверять совпадению размера и mtime файла
+# (быстрее старт на большом хранилище, но порча без изменения размера и mtime не будет замечена)
+EMBEDDING_STORE_VERIFY = os.environ.get('EMBEDDING_STORE_VERIFY', '1') != '0'
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+MANIFEST_FILE = 'manifest.json'
+
+
+def content_hash(text: str) -> str:
+    """Хэш содержимого чанка, по которому переиспользуются эмбеддинги"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def file_checksum(path: str) -> str:
+    """Контрольная сумма файла (sha256)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StoredRows:
+    """Строки матрицы хранилища в заданном порядке; читаются с диска по требованию (memory-map)"""
+
+    def __init__(self, matrix: np.ndarray, rows: np.ndarray):
+        self.matrix = matrix
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, ids) -> np.ndarray:
+        return np.asarray(self.matrix[self.rows[ids]], dtype=np.float32)
+
+
+class EmbeddingStore:
+    """
+    Хранилище эмбеддингов на диске: матрица в .npy (читается через memory-map)
+    и манифест с хэшами чанков, моделью, версией формата и контрольной суммой.
+    """
+
+    def __init__(self, directory: str = RAG_INDEX_DIR):
+        self.directory = directory
+        self.embeddings_path = os.path.join(directory, EMBEDDINGS_FILE)
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+
+    def load(self, model: str, verify: bool = EMBEDDING_STORE_VERIFY) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Загружает сохранённые эмбеддинги в виде {хэш чанка: вектор}.
+        Возвращает None, если артефакта нет, он от другой модели/версии или повреждён.
+        Без verify контрольная сумма считается, только если размер/mtime файла не совпали с манифестом.
+        """
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.embeddings_path)):
+            return None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            if manifest.get('format_version') != STORE_FORMAT_VERSION:
+                logger.info("Embedding store format changed, rebuilding")
+                return None
+            if manifest.get('model') != model:
+                logger.info(f"Embedding store was built with {manifest.get('model')}, rebuilding for {model}")
+                return None
+            stat = os.stat(self.embeddings_path)
+            unchanged = (stat.st_size, stat.st_mtime_ns) == (manifest.get('size'), manifest.get('mtime_ns'))
+            if (verify or not unchanged) and file_checksum(self.embeddings_path) != manifest.get('checksum'):
+                logger.warning("Embedding store checksum mismatch, rebuilding")
+                return None
+            matrix = np.load(self.embeddings_path, mmap_mode='r')
+            hashes = manifest['hashes']
+            if matrix.ndim != 2 or matrix.shape[0] != len(hashes):
+                logger.warning("Embedding store shape does not match manifest, rebuilding")
+                return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Embedding store is unreadable ({e}), rebuilding")
+            return None
+        return {chunk_hash: matrix[row] for row, chunk_hash in enumerate(hashes)}
+
+    def open_rows(self, model: str, hashes: Sequence[str]) -> Optional[StoredRows]:
+        """
+        Полноточные эмбеддинги чанков в порядке hashes без загрузки матрицы в память.
+        None, если в хранилище нет какого-то из чанков или оно от другой модели.
+        """
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            if manifest.get('format_version') != STORE_FORMAT_VERSION or manifest.get('model') != model:
+                return None
+            matrix = np.load(self.embeddings_path, mmap_mode='r')
+            row_of = {chunk_hash: row for row, chunk_hash in enumerate(manifest['hashes'])}
+            rows = np.array([row_of[chunk_hash] for chunk_hash in hashes], dtype=np.int64)
+        except (OSError, ValueError, KeyError):
+            return None
+        return StoredRows(matrix, rows)
+
+    def save(self, model: str, hashes: List[str], embeddings: np.ndarray):
+        """Атомарно сохраняет матрицу эмбеддингов (float32) и манифест"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_embeddings = self.embeddings_path + '.tmp'
+        tmp_manifest = self.manifest_path + '.tmp'
+
+        with open(tmp_embeddings, 'wb') as file:
+            np.save(file, np.ascontiguousarray(embeddings, dtype=np.float32))
+        # os.replace сохраняет mtime, поэтому размер и mtime временного файла совпадут с итоговым
+        stat = os.stat(tmp_embeddings)
+        manifest = {
+            'format_version': STORE_FORMAT_VERSION,
+            'model': model,
+            'dim': int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            'hashes': hashes,
+            'checksum': file_checksum(tmp_embeddings),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+        with open(tmp_manifest, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+
+        # Сначала матрица, затем манифест: манифест с чужой контрольной суммой отбракуется при загрузке
+        os.replace(tmp_embeddings, self.embeddings_path)
+        os.replace(tmp_manifest, self.manifest_path)
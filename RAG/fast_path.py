@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from RAG.embedding_store import RAG_INDEX_DIR
+
+logger = logging.getLogger(__name__)
+
+# Пороги, подобранные python -m RAG.calibrate_fast_path
+FAST_PATH_THRESHOLDS_PATH = os.environ.get(
+    'FAST_PATH_THRESHOLDS_PATH', os.path.join(RAG_INDEX_DIR, 'fast_path_thresholds.json')
+)
+# Журнал вердиктов грейдеров (JSON lines) для калибровки; пустой путь отключает журнал
+GRADER_VERDICT_LOG = os.environ.get('GRADER_VERDICT_LOG', '')
+
+# Решения быстрого пути и проверки, которые они пропускают
+SKIP_DOCUMENT_GRADING = 'skip_document_grading'
+SKIP_GENERATION_GRADING = 'skip_generation_grading'
+
+
+class FastPathPolicy:
+    """
+    Решает по статистикам поиска (KnowledgeIndex.retrieval_confidence), можно ли пропустить LLM-проверки.
+    Пороги задаются для каждого решения: {"skip_document_grading": {"metric": "top_cosine", "threshold": 0.71}, ...};
+    решение без порога никогда не срабатывает.
+    """
+
+    def __init__(self, thresholds: Optional[Dict[str, dict]] = None):
+        self.thresholds = thresholds or {}
+
+    @classmethod
+    def load(cls, path: str = FAST_PATH_THRESHOLDS_PATH) -> 'FastPathPolicy':
+        if not os.path.exists(path):
+            logger.info(f"No calibrated fast path thresholds at {path}, LLM grading is never skipped")
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                thresholds = json.load(file)['thresholds']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Fast path thresholds at {path} are unreadable ({e}), LLM grading is never skipped")
+            return cls()
+        logger.info(f"Fast path thresholds loaded from {path}: {thresholds}")
+        return cls(thresholds)
+
+    def allows(self, decision: str, confidence: Optional[Dict[str, float]]) -> bool:
+        rule = self.thresholds.get(decision)
+        if not rule or not confidence or rule.get('threshold') is None:
+            return False
+        return confidence.get(rule['metric'], float('-inf')) >= rule['threshold']
+
+
+class VerdictLog:
+    """Дописывает вердикты грейдеров вместе со статистиками поиска в JSON lines для калибровки"""
+
+    def __init__(self, path: str = GRADER_VERDICT_LOG):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def write(self, kind: str, confidence: Optional[Dict[str, float]], **verdicts):
+        if not self.enabled or not confidence:
+            return
+        record = {'time': time.time(), 'kind': kind, 'confidence': confidence, **verdicts}
+        try:
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.warning(f"Could not write grader verdict log: {e}")
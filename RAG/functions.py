@@ -4,6 +4,8 @@ from dotenv import load_dotenv
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 
+from RAG.grader_cache import CachedGrader, prompt_version
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,6 +26,11 @@ def get_chat_openai():
     )
 
 
+def cache_grader(chain, prompt, name):
+    """Wrap a grader chain with the verdict cache keyed on its inputs, model and prompt version"""
+    return CachedGrader(chain, name=name, model=f"{OPENAI_MODEL}@{OPENAI_TEMPERATURE}", version=prompt_version(prompt))
+
+
 def initialize_grader():
     from langchain_core.prompts import ChatPromptTemplate
     from langchain_core.pydantic_v1 import BaseModel, Field
@@ -49,7 +56,48 @@ def initialize_grader():
         ]
     )
 
-    return grade_prompt | structured_llm_grader
+    return cache_grader(grade_prompt | structured_llm_grader, grade_prompt, "retrieval_grader")
+
+
+def initialize_batch_grader():
+    """Grader that assesses all retrieved documents in one request and returns a verdict per document id"""
+    from typing import List
+
+    from langchain_core.pydantic_v1 import BaseModel, Field
+
+    class DocumentGrade(BaseModel):
+        id: int = Field(description="Id of the document as given in the input")
+        binary_score: str = Field(
+            description="Document is relevant to the question, 'yes' or 'no'"
+        )
+
+    class GradeDocumentsBatch(BaseModel):
+        grades: List[DocumentGrade] = Field(description="One grade for every document in the input")
+
+    llm = get_chat_openai()
+    structured_llm_grader = llm.with_structured_output(GradeDocumentsBatch)
+
+    system = """You are a grader assessing relevance of retrieved documents to a user question. \n 
+        Each document is preceded by its id in square brackets. Grade every document independently. \n
+        It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
+        If a document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
+        Return a binary score 'yes' or 'no' for each document id to indicate whether it is relevant to the question."""
+
+    grade_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", "Retrieved documents: \n\n {documents} \n\n User question: {question}"),
+        ]
+    )
+
+    return cache_grader(grade_prompt | structured_llm_grader, grade_prompt, "batch_retrieval_grader")
+
+
+def format_documents_for_batch_grading(documents):
+    """Number documents for the batch grader: '[id] text' blocks separated by blank lines"""
+    return "\n\n".join(
+        f"[{position}] {getattr(document, 'page_content', document)}" for position, document in enumerate(documents)
+    )
 
 
 def initialize_rag_chain():
@@ -116,7 +164,7 @@ def initialize_hallucination_grader():
         ]
     )
 
-    return hallucination_prompt | structured_llm_grader
+    return cache_grader(hallucination_prompt | structured_llm_grader, hallucination_prompt, "hallucination_grader")
 
 
 def initialize_answer_grader():
@@ -142,7 +190,7 @@ def initialize_answer_grader():
         ]
     )
 
-    return answer_prompt | structured_llm_grader
+    return cache_grader(answer_prompt | structured_llm_grader, answer_prompt, "answer_grader")
 
 
 def initialize_question_rewriter():
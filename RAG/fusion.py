@@ -0,0 +1,97 @@
+import os
+from typing import List, Sequence
+
+import numpy as np
+
+from RAG.vector_index import normalize_rows, top_k_indices
+
+# Способ объединения BM25 и векторного поиска: rrf (по рангам) или weighted (смешивание оценок)
+FUSION_STRATEGY = os.environ.get('FUSION_STRATEGY', 'weighted')
+# Сколько лучших кандидатов каждого поисковика участвует в RRF
+RRF_CANDIDATES = int(os.environ.get('RRF_CANDIDATES', 50))
+# Сглаживающая константа RRF: 1 / (RRF_K + ранг)
+RRF_K = int(os.environ.get('RRF_K', 60))
+
+
+def min_max_normalize(scores: np.ndarray) -> np.ndarray:
+    """Приведение оценок к [0, 1]; одинаковые оценки дают нули, а не деление на ноль"""
+    low, high = scores.min(), scores.max()
+    if high <= low:
+        return np.zeros_like(scores, dtype=np.float32)
+    return (scores - low) / (high - low)
+
+
+def distance_scores(cosine: np.ndarray) -> np.ndarray:
+    """
+    Векторные оценки, как при исходном поиске по L2-расстоянию: 1 - min-max(||q - d||).
+    Для единичных векторов ||q - d|| = sqrt(2 - 2cos); min-max расстояния не линеен по косинусу,
+    поэтому нормализовать сам косинус нельзя - смешанный с BM25 рейтинг получился бы другим.
+    """
+    return 1 - min_max_normalize(np.sqrt(np.maximum(2 - 2 * cosine, 0)))
+
+
+class FusionStrategy:
+    """
+    Интерфейс объединения результатов BM25 и векторного поиска.
+    alpha - вес векторного поиска, 1 - alpha - вес BM25.
+    """
+    name = 'base'
+
+    def rank_batch(self, index, bm25_scores: Sequence[np.ndarray], query_embeddings,
+                   k: int, alpha: float) -> List[np.ndarray]:
+        """Индексы top-k документов для каждого запроса"""
+        raise NotImplementedError
+
+
+class WeightedFusion(FusionStrategy):
+    """Min-max нормализация полных векторов оценок по корпусу (векторных - через расстояние) и смешивание с весом alpha"""
+    name = 'weighted'
+
+    def rank_batch(self, index, bm25_scores, query_embeddings, k, alpha):
+        vector_scores = index.vector_scores_batch(query_embeddings)
+        return [
+            top_k_indices(alpha * distance_scores(vector) + (1 - alpha) * min_max_normalize(bm25), k)
+            for bm25, vector in zip(bm25_scores, vector_scores)
+        ]
+
+
+class ReciprocalRankFusion(FusionStrategy):
+    """
+    Reciprocal rank fusion по top-N кандидатам каждого поисковика: alpha / (K + ранг) + (1 - alpha) / (K + ранг).
+    Работает только с рангами, поэтому не нужны ни оценки всего корпуса, ни их нормализация.
+    """
+    name = 'rrf'
+
+    def __init__(self, candidates: int = RRF_CANDIDATES, rrf_k: int = RRF_K):
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    def rank_batch(self, index, bm25_scores, query_embeddings, k, alpha):
+        depth = max(self.candidates, k)
+        _, vector_ids = index.vector_index.search(normalize_rows(query_embeddings), depth)
+        ranked = []
+        for bm25, row_ids in zip(bm25_scores, vector_ids):
+            fused = {}
+            for rank, doc_id in enumerate(row_ids[row_ids >= 0]):
+                fused[doc_id] = alpha / (self.rrf_k + rank + 1)
+            # Документы без единого совпавшего термина в BM25 не кандидаты
+            bm25_ids = top_k_indices(bm25, depth)
+            for rank, doc_id in enumerate(bm25_ids[bm25[bm25_ids] > 0]):
+                fused[doc_id] = fused.get(doc_id, 0.0) + (1 - alpha) / (self.rrf_k + rank + 1)
+            ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+            scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+            ranked.append(ids[top_k_indices(scores, k)])
+        return ranked
+
+
+FUSION_STRATEGIES = {
+    WeightedFusion.name: WeightedFusion,
+    ReciprocalRankFusion.name: ReciprocalRankFusion,
+}
+
+
+def create_fusion_strategy(name: str = FUSION_STRATEGY, **params) -> FusionStrategy:
+    """Создаёт стратегию объединения по имени"""
+    if name not in FUSION_STRATEGIES:
+        raise ValueError(f"Unknown fusion strategy '{name}', expected one of {', '.join(FUSION_STRATEGIES)}")
+    return FUSION_STRATEGIES[name](**params)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+logger = logging.getLogger(__name__)
+
+# 0 отключает кэш вердиктов
+GRADER_CACHE_SIZE = int(os.environ.get('GRADER_CACHE_SIZE', 20000))
+GRADER_CACHE_TTL_SECONDS = float(os.environ.get('GRADER_CACHE_TTL_SECONDS', 24 * 3600))
+
+_MISSING = object()
+
+
+def normalize_grader_input(value) -> Any:
+    """Приводит вход грейдера к стабильному виду: документы - к тексту, строки - без лишних пробелов"""
+    if hasattr(value, 'page_content'):
+        value = value.page_content
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, (list, tuple)):
+        return [normalize_grader_input(item) for item in value]
+    if isinstance(value, dict):
+        return {key: normalize_grader_input(item) for key, item in sorted(value.items())}
+    return str(value)
+
+
+def prompt_version(prompt) -> str:
+    """Короткий хэш текста промпта: правка промпта автоматически инвалидирует вердикты"""
+    messages = [(type(message).__name__, getattr(getattr(message, 'prompt', None), 'template', str(message)))
+                for message in getattr(prompt, 'messages', [prompt])]
+    return hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+
+
+class GraderCache:
+    """
+    LRU-кэш вердиктов LLM-грейдеров с TTL. Ключ - (грейдер, модель, версия промпта, хэш нормализованных входов).
+    Счётчики попаданий ведутся по каждому грейдеру.
+    """
+
+    def __init__(self, max_size: int = GRADER_CACHE_SIZE, ttl_seconds: float = GRADER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(grader: str, model: str, version: str, inputs: dict) -> tuple:
+        digest = hashlib.sha256(
+            json.dumps(normalize_grader_input(inputs), ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        return grader, model, version, digest
+
+    def _count(self, grader: str, counter: str):
+        counters = self._counters.setdefault(grader, {'hits': 0, 'misses': 0})
+        counters[counter] += 1
+
+    def get(self, key: tuple):
+        """Вердикт из кэша или _MISSING"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self._count(key[0], 'misses')
+                return _MISSING
+            self._entries.move_to_end(key)
+            self._count(key[0], 'hits')
+            return entry[1]
+
+    def put(self, key: tuple, verdict):
+        with self._lock:
+            self._entries[key] = (time.time(), verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Размер кэша, hit rate по всем грейдерам вместе и по каждому"""
+        with self._lock:
+            graders = {}
+            for grader, counters in self._counters.items():
+                lookups = counters['hits'] + counters['misses']
+                graders[grader] = {**counters, 'hit_rate': counters['hits'] / lookups if lookups else 0.0}
+            hits = sum(counters['hits'] for counters in self._counters.values())
+            misses = sum(counters['misses'] for counters in self._counters.values())
+            return {
+                'size': len(self._entries),
+                'hits': hits,
+                'misses': misses,
+                'evictions': self.evictions,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                'graders': graders,
+            }
+
+
+grader_cache = GraderCache()
+
+
+class CachedGrader(Runnable):
+    """
+    Обёртка над цепочкой грейдера с мемоизацией вердиктов. Остаётся Runnable:
+    invoke/ainvoke/batch/abatch работают как у исходной цепочки, но повторные входы не идут в LLM.
+    """
+
+    def __init__(self, chain: Runnable, name: str, model: str, version: str, cache: Optional[GraderCache] = None):
+        self.chain = chain
+        self.name = name
+        self.model = model
+        self.version = version
+        self.cache = cache if cache is not None else grader_cache
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.max_size > 0
+
+    def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs):
+        if not self.enabled:
+            return self.chain.invoke(input, config, **kwargs)
+        key = self.cache.make_key(self.name, self.model, self.version, input)
+        verdict = self.cache.get(key)
+        if verdict is _MISSING:
+            verdict = self.chain.invoke(input, config, **kwargs)
+            self.cache.put(key, verdict)
+        return verdict
+
+    async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs):
+        if not self.enabled:
+            return await self.chain.ainvoke(input, config, **kwargs)
+        key = self.cache.make_key(self.name, self.model, self.version, input)
+        verdict = self.cache.get(key)
+        if verdict is _MISSING:
+            verdict = await self.chain.ainvoke(input, config, **kwargs)
+            self.cache.put(key, verdict)
+        return verdict
@@ -1,5 +1,9 @@
+import asyncio
 import logging
+import os
 from RAG.functions import (
+    format_documents_for_batch_grading,
+    initialize_batch_grader,
     initialize_grader,
     initialize_rag_chain,
     initialize_hallucination_grader,
@@ -7,15 +11,28 @@ from RAG.functions import (
     initialize_question_rewriter,
 )
 from typing_extensions import TypedDict
-from typing import List
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from openai_helper import OpenAIHelper
+from RAG.fast_path import FastPathPolicy, SKIP_DOCUMENT_GRADING, SKIP_GENERATION_GRADING, VerdictLog
 from RAG.rag import EmbeddingService
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Сколько документов оцениваются грейдером одновременно
+GRADER_CONCURRENCY = int(os.environ.get('GRADER_CONCURRENCY', 5))
+# Таймаут оценки одного документа; 0 - без таймаута
+GRADER_TIMEOUT_SECONDS = float(os.environ.get('GRADER_TIMEOUT_SECONDS', 15))
+# Остановить оценку, как только найдено столько релевантных документов; 0 - оценивать все
+GRADER_STOP_AFTER_RELEVANT = int(os.environ.get('GRADER_STOP_AFTER_RELEVANT', 0))
+# per_document - отдельный запрос на каждый документ, batch - один запрос с вердиктом по каждому документу
+GRADING_MODE = os.environ.get('GRADING_MODE', 'per_document')
+# 1 - проверки ответа на галлюцинации и на полезность запускаются одновременно, 0 - друг за другом
+GENERATION_GRADERS_CONCURRENT = os.environ.get('GENERATION_GRADERS_CONCURRENT', '1') == '1'
+
 # Инициализация всех компонентов
 retrieval_grader = initialize_grader()
+batch_retrieval_grader = initialize_batch_grader()
 rag_chain = initialize_rag_chain()
 hallucination_grader = initialize_hallucination_grader()
 answer_grader = initialize_answer_grader()
@@ -25,6 +42,9 @@ question_rewriter = initialize_question_rewriter()
 embedding_service = EmbeddingService()
 logger.info("EmbeddingService initialized successfully")
 
+# Вердикты грейдеров со статистиками поиска - данные для калибровки быстрого пути
+verdict_log = VerdictLog()
+
 
 class GraphState(TypedDict):
     """
@@ -36,6 +56,10 @@ class GraphState(TypedDict):
         documents: list of documents
         transformation_count: количество перегенераций вопроса
         first_question: первый вопрос пользователя
+        on_draft: async-колбэк, получающий черновик ответа по мере генерации (None - без стриминга)
+        retrieval_confidence: статистики уверенности последнего поиска (top_cosine, mean_cosine, top_bm25)
+        context: контекст из документов, упакованный в бюджет токенов, с которым шла последняя генерация
+        request_id: идентификатор запроса пользователя в журнале вердиктов (один на прогон графа)
     """
     question: str
     generation: str
@@ -45,26 +69,31 @@ class GraphState(TypedDict):
     openai_helper: OpenAIHelper
     total_tokens: int
     chat_id: int
+    on_draft: Optional[Callable[[str], Awaitable[None]]]
+    context: str
+    retrieval_confidence: Dict[str, float]
+    request_id: str
 
 
 ### Nodes
 
-def retrieve(state: GraphState):
+async def retrieve(state: GraphState):
     logger.info("---RETRIEVE---")
     question = state["question"]
     
-    # Use EmbeddingService's fusion_retrieval for better search results
-    documents = embedding_service.fusion_retrieval(
+    # Use EmbeddingService's fusion_retrieval for better search results (without blocking the event loop)
+    documents, confidence = await embedding_service.afusion_retrieval_with_confidence(
         query=question,
         k=5,  # Number of most relevant documents to return
         alpha=0.5  # Balance between semantic (0.5) and keyword search (0.5)
     )
     
     first_question = state.get("first_question", question)
-    logger.info(f"Retrieved {len(documents)} relevant documents for question: {question}")
+    logger.info(f"Retrieved {len(documents)} relevant documents for question: {question} ({confidence})")
     
     return {
         "documents": documents,
+        "retrieval_confidence": confidence,
         "question": question,
         "transformation_count": state.get("transformation_count", 0),
         "first_question": first_question,
@@ -81,19 +110,36 @@ async def generate(state: GraphState):
     openai_helper = state["openai_helper"]
     chat_id = state["chat_id"]
 
+    # Best-ranked chunks within CONTEXT_TOKEN_BUDGET, adjacent chunks merged without the overlap
+    context = embedding_service.build_context(documents)
+    logger.info(f"Packed {context.packed} of {len(documents)} documents into {context.tokens} context tokens "
+                f"({context.overlap_tokens} overlap tokens removed)")
+
     prompt = f"""You are an assistant for question-answering tasks.\n
          Use the following pieces of retrieved context to answer the question.\n
          **If you don't know the answer, just say that you don't know.** \n
          Keep the answer concise. \n\n
-         User question: \n\n {question} \n\n Context: {documents} \n\n Answer:"""
+         User question: \n\n {question} \n\n Context: \n\n{context} \n\n Answer:"""
     total_tokens = 0
-    generation, total_tokens = await openai_helper.get_chat_response(chat_id=chat_id, query=prompt)
+    on_draft = state.get("on_draft")
+    # The retrieved context goes into this request only; run_graph stores the question and the final answer
+    if on_draft is None:
+        generation, total_tokens = await openai_helper.get_chat_response_with_context(chat_id=chat_id, prompt=prompt)
+    else:
+        # The draft is shown to the user while it is generated; grading starts once the stream ends
+        async for generation, tokens in openai_helper.get_chat_response_with_context_stream(chat_id=chat_id,
+                                                                                          prompt=prompt):
+            if tokens == 'not_finished':
+                await on_draft(generation)
+            else:
+                total_tokens = int(tokens)
     print('\n')
     print(generation)
     return {
         "documents": documents,
         "question": question,
         "generation": generation,
+        "context": context.text,
         "transformation_count": state.get("transformation_count", 0),
         "first_question": state["first_question"],
         "openai_helper": state["openai_helper"],
@@ -102,24 +148,120 @@ async def generate(state: GraphState):
     }
 
 
-def grade_documents(state: GraphState):
-    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
-    question = state["question"]
-    documents = state["documents"]
-    filtered_docs = []
-    for d in documents:
-        score = retrieval_grader.invoke({"question": question, "document": d})
-        grade = score.binary_score
-        if grade == "yes":
+async def grade_document(question: str, document, position: int, semaphore: asyncio.Semaphore):
+    """
+    Grades one document under the concurrency cap and returns (position, is_relevant).
+    is_relevant is None when grading times out or fails; such a document is kept: the retrieval
+    grader only filters out obvious misses, and the generation is still checked by the hallucination grader.
+    """
+    async with semaphore:
+        try:
+            score = await asyncio.wait_for(
+                retrieval_grader.ainvoke({"question": question, "document": document}),
+                timeout=GRADER_TIMEOUT_SECONDS or None,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Document grading timed out after {GRADER_TIMEOUT_SECONDS} s, keeping the document")
+            return position, None
+        except Exception as e:
+            logger.warning(f"Document grading failed ({str(e)}), keeping the document")
+            return position, None
+    return position, score.binary_score == "yes"
+
+
+async def grade_documents_per_document(question: str, documents) -> Tuple[Set[int], Dict[int, bool]]:
+    """
+    Grades documents with one concurrent grader call each.
+    Returns positions of the kept documents and the verdicts of the documents the grader actually judged
+    (without those skipped by the early stop or whose grading failed).
+    """
+    semaphore = asyncio.Semaphore(max(1, GRADER_CONCURRENCY))
+    tasks = [asyncio.ensure_future(grade_document(question, d, position, semaphore))
+             for position, d in enumerate(documents)]
+    relevant = set()
+    verdicts = {}
+    try:
+        for task in asyncio.as_completed(tasks):
+            position, is_relevant = await task
+            if is_relevant is not None:
+                verdicts[position] = is_relevant
+            if is_relevant is not False:
+                print("---GRADE: DOCUMENT RELEVANT---")
+                relevant.add(position)
+            else:
+                print("---GRADE: DOCUMENT NOT RELEVANT---")
+            print(f"\n{documents[position]}\n")
+            if GRADER_STOP_AFTER_RELEVANT and len(relevant) >= GRADER_STOP_AFTER_RELEVANT:
+                print(f"---{len(relevant)} RELEVANT DOCUMENTS FOUND, SKIPPING THE REST---")
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    return relevant, verdicts
+
+
+async def grade_documents_batch(question: str, documents) -> Tuple[Set[int], Dict[int, bool]]:
+    """
+    Grades all documents in a single structured-output call.
+    Returns positions of the kept documents and the verdicts the grader gave. Documents the grader left
+    without a verdict, or all of them if the call times out or fails, are kept.
+    """
+    if not documents:
+        return set(), {}
+    try:
+        result = await asyncio.wait_for(
+            batch_retrieval_grader.ainvoke({
+                "question": question,
+                "documents": format_documents_for_batch_grading(documents),
+            }),
+            timeout=GRADER_TIMEOUT_SECONDS or None,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Batch grading timed out after {GRADER_TIMEOUT_SECONDS} s, keeping all documents")
+        return set(range(len(documents))), {}
+    except Exception as e:
+        logger.warning(f"Batch grading failed ({str(e)}), keeping all documents")
+        return set(range(len(documents))), {}
+
+    verdicts = {grade.id: grade.binary_score == "yes" for grade in result.grades
+                if 0 <= grade.id < len(documents)}
+    relevant = set()
+    for position, d in enumerate(documents):
+        if verdicts.get(position, True):
             print("---GRADE: DOCUMENT RELEVANT---")
-            print(f"\n{d}\n")
-            filtered_docs.append(d)
+            relevant.add(position)
         else:
             print("---GRADE: DOCUMENT NOT RELEVANT---")
-            print(f"\n{d}\n")
-            continue
-        print('\n')
-        print(filtered_docs)
+        print(f"\n{d}\n")
+    missing = len(documents) - len(verdicts)
+    if missing:
+        logger.warning(f"Batch grader returned no verdict for {missing} document(s), keeping them")
+    return relevant, verdicts
+
+
+GRADING_MODES = {
+    "per_document": grade_documents_per_document,
+    "batch": grade_documents_batch,
+}
+if GRADING_MODE not in GRADING_MODES:
+    raise ValueError(f"Unknown GRADING_MODE '{GRADING_MODE}', expected one of {', '.join(GRADING_MODES)}")
+
+
+async def grade_documents(state: GraphState):
+    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+    question = state["question"]
+    documents = state["documents"]
+
+    relevant, verdicts = await GRADING_MODES[GRADING_MODE](question, documents)
+
+    # Only real verdicts count: documents skipped by the early stop or kept after a failed call were not judged
+    if verdicts:
+        verdict_log.write("documents", state.get("retrieval_confidence"), request_id=state.get("request_id"),
+                          relevant=sum(verdicts.values()), graded=len(verdicts), retrieved=len(documents))
+
+    # Keep the retrieval order regardless of which grading finished first
+    filtered_docs = [d for position, d in enumerate(documents) if position in relevant]
+    print(filtered_docs)
     return {
         "documents": filtered_docs,
         "question": question,
@@ -180,32 +322,79 @@ def decide_to_generate(state: GraphState):
         return "generate"
 
 
-def grade_generation_vs_documents_and_question(state: GraphState):
+async def grade_generation_vs_documents_and_question(state: GraphState):
     print("---CHECK HALLUCINATIONS---")
     question = state["question"]
-    documents = state["documents"]
+    # The generation is checked against the context it was given, not the documents dropped by packing
+    context = state.get("context") or state["documents"]
     generation = state["generation"]
     first_question = state["first_question"]
     print('\n')
     print(question)
     print('\n')
 
-    score = hallucination_grader.invoke({"documents": documents, "generation": generation})
-    grade = score.binary_score
-    if grade == "yes":
+    # In concurrent mode the answer grader starts right away and is cancelled if the generation is not grounded
+    answer_task = None
+    if GENERATION_GRADERS_CONCURRENT:
+        answer_task = asyncio.ensure_future(
+            answer_grader.ainvoke({"question": first_question, "generation": generation})
+        )
+    try:
+        score = await hallucination_grader.ainvoke({"documents": context, "generation": generation})
+        grade = score.binary_score
+        if grade != "yes":
+            print("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
+            verdict_log.write("generation", state.get("retrieval_confidence"), request_id=state.get("request_id"),
+                              grounded=False, useful=None)
+            return "not supported"
         print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTС---")
         print("---GRADE GENERATION vs QUESTION---")
-        score = answer_grader.invoke({"question": first_question, "generation": generation})
-        grade = score.binary_score
-        if grade == "yes":
-            print("---DECISION: GENERATION ADDRESSES QUESTION---")
-            return "useful"
+        if answer_task is None:
+            score = await answer_grader.ainvoke({"question": first_question, "generation": generation})
         else:
-            print("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
-            return "not useful"
+            score = await answer_task
+    finally:
+        if answer_task is not None and not answer_task.done():
+            answer_task.cancel()
+    grade = score.binary_score
+    verdict_log.write("generation", state.get("retrieval_confidence"), request_id=state.get("request_id"),
+                      grounded=True, useful=grade == "yes")
+    if grade == "yes":
+        print("---DECISION: GENERATION ADDRESSES QUESTION---")
+        return "useful"
     else:
-        print("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
-        return "not supported"
+        print("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
+        return "not useful"
+
+
+def adaptive_grade_documents(policy: FastPathPolicy):
+    """grade_documents node that keeps all retrieved documents without LLM grading when retrieval is confident"""
+    async def grade_documents_or_skip(state: GraphState):
+        if not policy.allows(SKIP_DOCUMENT_GRADING, state.get("retrieval_confidence")):
+            return await grade_documents(state)
+        print("---CONFIDENT RETRIEVAL: SKIPPING DOCUMENT GRADING---")
+        return {
+            "documents": state["documents"],
+            "question": state["question"],
+            "transformation_count": state.get("transformation_count", 0),
+            "first_question": state["first_question"],
+            "openai_helper": state["openai_helper"],
+            "total_tokens": state["total_tokens"],
+            "chat_id": state["chat_id"]
+        }
+
+    return grade_documents_or_skip
+
+
+def adaptive_grade_generation(policy: FastPathPolicy):
+    """Generation grading edge that accepts the answer without the graders when retrieval is confident"""
+    async def grade_generation_or_skip(state: GraphState):
+        if not policy.allows(SKIP_GENERATION_GRADING, state.get("retrieval_confidence")):
+            return await grade_generation_vs_documents_and_question(state)
+        print("---CONFIDENT RETRIEVAL: SKIPPING GENERATION GRADING---")
+        return "useful"
+
+    return grade_generation_or_skip
 
 
 def decide_to_transform_query(state: GraphState):
@@ -0,0 +1,236 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+# Период сводки по узлам графа в логе, секунды; 0 отключает сводку
+GRAPH_METRICS_LOG_INTERVAL = float(os.environ.get('GRAPH_METRICS_LOG_INTERVAL', 300))
+
+# Границы корзин 1-2-5 от 1 до 10^6: подходят и для миллисекунд, и для числа токенов
+BUCKET_BOUNDS = [mantissa * 10 ** exponent for exponent in range(7) for mantissa in (1, 2, 5)][:-2]
+
+METRICS = ('ms', 'llm_calls', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'visits')
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: постоянная память, перцентили оцениваются интерполяцией"""
+
+    def __init__(self, bounds: List[float] = BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = max(self.bounds[bucket - 1] if bucket else 0.0, self.min)
+                high = self.bounds[bucket] if bucket < len(self.bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'max': self.max,
+        }
+
+
+class GraphRunTrace(BaseCallbackHandler):
+    """
+    Колбэк LangChain для одного прогона графа: время каждого узла и условного ребра,
+    число вызовов LLM и токены, привязанные к узлу, в котором они сделаны.
+    Время ребра (например, проверки ответа грейдерами) вычитается из времени узла, после которого оно идёт.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._graph_run: Optional[UUID] = None
+        self._stage_of: Dict[UUID, str] = {}
+        self._timed: Dict[UUID, tuple] = {}
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(Counter)
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       tags: Optional[List[str]] = None, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        name = kwargs.get('name')
+        if parent_run_id is None:
+            self._graph_run = run_id
+            return
+        parent_stage = self._stage_of.get(parent_run_id)
+        if parent_run_id == self._graph_run and name == (metadata or {}).get('langgraph_node') \
+                and not name.startswith('__'):
+            # Узел графа
+            self._stage_of[run_id] = name
+            self._timed[run_id] = (name, None, time.perf_counter())
+            self.stages[name]['visits'] += 1
+        elif parent_run_id in self._timed and self._timed[parent_run_id][1] is None and name \
+                and not name.startswith('_') and 'langsmith:hidden' not in (tags or []) \
+                and any(tag.startswith('seq:step:') and tag != 'seq:step:1' for tag in tags or []):
+            # Условное ребро - шаг узла после записи состояния; шаг 1 - сама функция узла,
+            # его тег наследуют цепочки, вызванные из неё (например, грейдеры)
+            self._stage_of[run_id] = name
+            self._timed[run_id] = (name, parent_run_id, time.perf_counter())
+            self.stages[name]['visits'] += 1
+        elif parent_stage is not None:
+            self._stage_of[run_id] = parent_stage
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id: UUID):
+        timed = self._timed.pop(run_id, None)
+        if timed is None:
+            return
+        stage, node_run, started = timed
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stages[stage]['ms'] += elapsed
+        if node_run is not None:
+            self.stages[self._stage_of[node_run]]['ms'] -= elapsed
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                            **kwargs):
+        self._llm_start(run_id, parent_run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
+        self._llm_start(run_id, parent_run_id)
+
+    def _llm_start(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        stage = self._stage_of.get(parent_run_id)
+        if stage is not None:
+            self._stage_of[run_id] = stage
+            self.stages[stage]['llm_calls'] += 1
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        stage = self._stage_of.get(run_id)
+        if stage is None:
+            return
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        self.add_tokens(stage, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+
+    def add_tokens(self, stage: str, prompt_tokens: int = 0, completion_tokens: int = 0, total_tokens: int = 0):
+        self.stages[stage]['prompt_tokens'] += prompt_tokens
+        self.stages[stage]['completion_tokens'] += completion_tokens
+        self.stages[stage]['total_tokens'] += total_tokens or prompt_tokens + completion_tokens
+
+    def add_llm_call(self, stage: str, total_tokens: int = 0):
+        """Вызов LLM мимо LangChain (например, генерация через OpenAIHelper), которого колбэк не видит"""
+        self.stages[stage]['llm_calls'] += 1
+        self.add_tokens(stage, total_tokens=total_tokens)
+
+
+class GraphMetrics:
+    """
+    Гистограммы по каждому узлу графа и каждой метрике, накопленные по всем прогонам.
+    Одно наблюдение - сумма за прогон: узел, пройденный дважды (повторная генерация), даёт одно значение с visits=2.
+    """
+
+    def __init__(self, log_interval: float = GRAPH_METRICS_LOG_INTERVAL):
+        self.log_interval = log_interval
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[str, Histogram]] = defaultdict(lambda: defaultdict(Histogram))
+        self._caches: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._logger_started = False
+
+    def trace(self) -> GraphRunTrace:
+        """Колбэк для нового прогона; передаётся в config={'callbacks': [...]} при app.astream"""
+        self._start_logger()
+        return GraphRunTrace()
+
+    def record(self, trace: GraphRunTrace, pipeline: str = 'default'):
+        """Добавляет завершённый прогон в гистограммы; время всего прогона - под ключом 'run:<pipeline>'"""
+        with self._lock:
+            for stage, values in trace.stages.items():
+                for metric in METRICS:
+                    self._histograms[stage][metric].observe(max(values.get(metric, 0), 0))
+            self._histograms[f'run:{pipeline}']['ms'].observe((time.perf_counter() - trace.started) * 1000)
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """{узел: {метрика: {count, mean, p50, p95, max}}}"""
+        with self._lock:
+            return {stage: {metric: histogram.summary() for metric, histogram in metrics.items()}
+                    for stage, metrics in self._histograms.items()}
+
+    def register_cache(self, name: str, stats: Callable[[], Dict[str, float]]):
+        """Кэш, чьи счётчики (size, hits, misses, hit_rate) выводятся в сводке рядом с узлами графа"""
+        with self._lock:
+            self._caches[name] = stats
+        self._start_logger()
+
+    def cache_stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            caches = dict(self._caches)
+        return {name: stats() for name, stats in caches.items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def summary(self) -> str:
+        """Таблица p50/p95 времени, вызовов LLM и токенов по узлам и счётчики зарегистрированных кэшей"""
+        lines = []
+        for stage, metrics in sorted(self.snapshot().items()):
+            ms = metrics.get('ms', Histogram().summary())
+            line = f"{stage}: n={ms['count']} p50={ms['p50']:.0f} ms p95={ms['p95']:.0f} ms"
+            if 'llm_calls' in metrics:
+                line += (f" llm_calls={metrics['llm_calls']['mean']:.1f}"
+                         f" tokens p50={metrics['total_tokens']['p50']:.0f}"
+                         f" p95={metrics['total_tokens']['p95']:.0f}"
+                         f" visits={metrics['visits']['mean']:.2f}")
+            lines.append(line)
+        for name, stats in self.cache_stats().items():
+            # Ответы из кэша ответов не проходят граф, поэтому кэши выводятся и без прогонов
+            if stats['size'] or stats['hits'] or stats['misses']:
+                line = (f"cache {name}: size={stats['size']} hits={stats['hits']} misses={stats['misses']} "
+                        f"hit_rate={stats['hit_rate']:.1%}")
+                # Кэш из нескольких частей (например, вердикты каждого грейдера) - с разбивкой по частям
+                if stats.get('graders'):
+                    line += ' (' + ', '.join(f"{part} {counters['hit_rate']:.1%}"
+                                             for part, counters in sorted(stats['graders'].items())) + ')'
+                lines.append(line)
+        return '\n'.join(lines)
+
+    def _start_logger(self):
+        with self._lock:
+            if self._logger_started or self.log_interval <= 0:
+                return
+            self._logger_started = True
+
+        def log_summary():
+            while True:
+                time.sleep(self.log_interval)
+                summary = self.summary()
+                if summary:
+                    logger.info(f"RAG graph stages since start:\n{summary}")
+
+        threading.Thread(target=log_summary, name='graph-metrics', daemon=True).start()
+
+
+graph_metrics = GraphMetrics()
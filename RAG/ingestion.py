@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+from html.parser import HTMLParser
+from typing import Callable, Dict, List
+
+from langchain.docstore.document import Document
+
+from RAG.embedding_store import RAG_INDEX_DIR
+
+logger = logging.getLogger(__name__)
+
+# Файл или каталог с документами базы знаний
+KNOWLEDGE_BASE_PATH = os.environ.get('KNOWLEDGE_BASE_PATH', 'data.txt')
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', 750))
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', 50))
+
+SUPPORTED_EXTENSIONS = ('.txt', '.md', '.markdown', '.html', '.htm')
+
+MANIFEST_FORMAT_VERSION = 1
+INGEST_MANIFEST_FILE = 'ingest_manifest.json'
+
+
+class IngestionError(Exception):
+    """Источник базы знаний недоступен или пуст: индекс и хранилище эмбеддингов не трогаем"""
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Достаёт видимый текст из HTML, пропуская script/style"""
+    _SKIP_TAGS = ('script', 'style', 'noscript', 'template')
+    _BLOCK_TAGS = ('p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article')
+
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self._BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self._BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """Текст HTML-документа без разметки"""
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = (' '.join(line.split()) for line in ''.join(extractor.parts).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def read_document(path: str) -> str:
+    """Читает документ базы знаний как текст"""
+    with open(path, 'r', encoding='utf-8') as file:
+        content = file.read()
+    if path.lower().endswith(('.html', '.htm')):
+        return html_to_text(content)
+    return content
+
+
+class IngestionPipeline:
+    """
+    Загрузка базы знаний из файла или каталога (txt/markdown/html) с инкрементальной переиндексацией.
+    Манифест хранит хэш каждого файла и его чанки: при повторном запуске режутся только изменённые
+    файлы, чанки удалённых файлов выпадают из корпуса (а их векторы - из хранилища эмбеддингов).
+    """
+
+    def __init__(self, source: str = KNOWLEDGE_BASE_PATH, splitter: Callable[[str, int, int], List[str]] = None,
+                 chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                 manifest_path: str = os.path.join(RAG_INDEX_DIR, INGEST_MANIFEST_FILE)):
+        self.source = source
+        self.splitter = splitter
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.manifest_path = manifest_path
+
+    def list_files(self) -> Dict[str, str]:
+        """{относительный путь: полный путь} для всех поддерживаемых файлов источника"""
+        if os.path.isfile(self.source):
+            return {os.path.basename(self.source): self.source}
+        files = {}
+        for root, _, names in os.walk(self.source):
+            for name in names:
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    files[os.path.relpath(path, self.source).replace(os.sep, '/')] = path
+        return files
+
+    def stat_signature(self) -> Dict[str, tuple]:
+        """Дешёвый отпечаток источника (размер и mtime файлов) для наблюдения за изменениями"""
+        signature = {}
+        for name, path in self.list_files().items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature[name] = (stat.st_size, stat.st_mtime_ns)
+        return signature
+
+    def file_hashes(self, files: Dict[str, str] = None) -> Dict[str, str]:
+        """{относительный путь: sha256 содержимого} для файлов источника"""
+        hashes = {}
+        for name, path in sorted((files or self.list_files()).items()):
+            with open(path, 'rb') as file:
+                hashes[name] = hashlib.sha256(file.read()).hexdigest()
+        return hashes
+
+    def load_manifest(self) -> Dict[str, dict]:
+        """Записи манифеста по файлам; при смене формата или параметров нарезки - пусто"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ingestion manifest is unreadable ({e}), re-chunking everything")
+            return {}
+        if (manifest.get('format_version'), manifest.get('chunk_size'), manifest.get('chunk_overlap')) != \
+                (MANIFEST_FORMAT_VERSION, self.chunk_size, self.chunk_overlap):
+            return {}
+        return manifest.get('files', {})
+
+    def save_manifest(self, files: Dict[str, dict]):
+        """Атомарно сохраняет манифест"""
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'format_version': MANIFEST_FORMAT_VERSION,
+                'chunk_size': self.chunk_size,
+                'chunk_overlap': self.chunk_overlap,
+                'files': files,
+            }, file, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def run(self) -> List[Document]:
+        """
+        Возвращает актуальные чанки всей базы знаний, перечитывая только изменённые файлы.
+        Пропавший или пустой источник (посреди rsync, деплоя через mv) - IngestionError, манифест не трогаем.
+        """
+        if not os.path.exists(self.source):
+            raise IngestionError(f"Knowledge base source {self.source} does not exist")
+        files = self.list_files()
+        if not files:
+            raise IngestionError(f"No knowledge base documents ({', '.join(SUPPORTED_EXTENSIONS)}) in {self.source}")
+        previous = self.load_manifest()
+        current = {}
+        changed, removed = [], [name for name in previous if name not in files]
+
+        for name, file_hash in self.file_hashes(files).items():
+            entry = previous.get(name)
+            if entry is None or entry['hash'] != file_hash:
+                chunks = self.splitter(read_document(files[name]), self.chunk_size, self.chunk_overlap)
+                entry = {'hash': file_hash, 'chunks': chunks}
+                changed.append(name)
+            current[name] = entry
+
+        if not any(entry['chunks'] for entry in current.values()):
+            raise IngestionError(f"Knowledge base at {self.source} has no text")
+        if changed or removed:
+            logger.info(f"Knowledge base: {len(changed)} file(s) re-chunked, {len(removed)} removed, "
+                        f"{len(current) - len(changed)} unchanged")
+            self.save_manifest(current)
+
+        return [
+            Document(page_content=chunk, metadata={'source': name, 'chunk_id': f'{name}#{index}'})
+            for name, entry in current.items()
+            for index, chunk in enumerate(entry['chunks'])
+        ]
@@ -0,0 +1,151 @@
+import atexit
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 4096))
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get('QUERY_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+# Пустой путь отключает сохранение кэша на диск
+QUERY_CACHE_PATH = os.environ.get('QUERY_CACHE_PATH', '')
+QUERY_CACHE_SPILL_EVERY = int(os.environ.get('QUERY_CACHE_SPILL_EVERY', 100))
+
+
+def save_npz_atomically(path: str, **arrays):
+    """Пишет .npz в уникальный временный файл рядом с path и подменяет path одним rename"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory or '.', prefix=os.path.basename(path) + '.',
+                                     suffix='.tmp', delete=False) as file:
+        tmp_path = file.name
+        try:
+            np.savez(file, **arrays)
+        except BaseException:
+            file.close()
+            os.unlink(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+
+def normalize_query(query: str) -> str:
+    """Нормализация текста запроса для ключа кэша: регистр и пробелы не важны"""
+    return ' '.join(query.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    LRU-кэш эмбеддингов запросов с TTL. Ключ - (модель, нормализованный запрос).
+    Потокобезопасен: используется и из event loop, и из executor.
+    Периодический сброс на диск идёт в фоновом потоке, сохранения выполняются строго по одному.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+                 path: str = QUERY_CACHE_PATH, spill_every: int = QUERY_CACHE_SPILL_EVERY):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.spill_every = spill_every
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        self._spill_pending = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, query: str, model: str) -> Optional[np.ndarray]:
+        """Эмбеддинг из кэша или None"""
+        key = (model, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, model: str, embedding):
+        """Кладёт эмбеддинг в кэш, вытесняя самые давно использованные записи"""
+        key = (model, normalize_query(query))
+        with self._lock:
+            self._entries[key] = (time.time(), np.asarray(embedding, dtype=np.float32))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._unsaved += 1
+            spill = bool(self.path) and self._unsaved >= self.spill_every and not self._spill_pending
+            self._spill_pending = self._spill_pending or spill
+        if spill:
+            # np.savez не должен блокировать event loop или поток поиска
+            threading.Thread(target=self.save, name='query-cache-spill', daemon=True).start()
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики для мониторинга"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def save(self):
+        """Сбрасывает живые записи на диск (атомарно)"""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                now = time.time()
+                entries = [(key, created, vector) for key, (created, vector) in self._entries.items()
+                           if now - created <= self.ttl_seconds]
+                self._unsaved = 0
+                self._spill_pending = False
+            if not entries:
+                return
+            try:
+                save_npz_atomically(
+                    self.path,
+                    models=np.array([key[0] for key, _, _ in entries]),
+                    queries=np.array([key[1] for key, _, _ in entries]),
+                    created=np.array([created for _, created, _ in entries]),
+                    vectors=np.stack([vector for _, _, vector in entries]),
+                )
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not persist query embedding cache: {e}")
+
+    def load(self):
+        """Поднимает сохранённые записи с диска, пропуская просроченные"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                now = time.time()
+                with self._lock:
+                    for model, query, created, vector in zip(data['models'], data['queries'],
+                                                             data['created'], data['vectors']):
+                        if now - created <= self.ttl_seconds:
+                            self._entries[(str(model), str(query))] = (float(created), vector)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Query embedding cache at {self.path} is unreadable ({e}), starting empty")
@@ -1,45 +1,371 @@
+import asyncio
+import logging
+import threading
+import time
+
 import openai
 import numpy as np
+import tiktoken
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
-from rank_bm25 import BM25Okapi
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+from RAG.artifact import ArtifactError, KB_ARTIFACT_PATH, read_artifact, write_artifact
+from RAG.bm25 import SparseBM25, tokenize
+from RAG.context_packing import CONTEXT_TOKEN_BUDGET, PackedContext, pack_context
+from RAG.embedding_store import EmbeddingStore, content_hash
+from RAG.fusion import FusionStrategy, create_fusion_strategy
+from RAG.ingestion import IngestionPipeline
+from RAG.query_cache import QueryEmbeddingCache
+from RAG.vector_index import create_vector_index, normalize_rows, QuantizedVectors, VECTOR_INDEX_FILE
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Устанавливаем ключ API OpenAI
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Ограничения одного запроса к embeddings API (до 2048 входов, ~300k токенов суммарно)
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", 2048))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 300000))
+# Сколько батчей отправляем одновременно
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+
+# Точность хранения нормализованной матрицы эмбеддингов в памяти: float32, float16 или int8 (с масштабом на вектор)
+EMBEDDING_DTYPE = np.dtype(os.getenv("EMBEDDING_DTYPE", "float32"))
+# Сколько кандидатов берём из приближённого индекса для смешивания с BM25
+VECTOR_SEARCH_CANDIDATES = int(os.getenv("VECTOR_SEARCH_CANDIDATES", 100))
+
+# Период (в секундах) проверки файлов базы знаний на изменения; 0 - наблюдение выключено
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", 0))
+# Горячая пересборка не подменяет индекс, если корпус потерял больше этой доли чанков; 1 - без ограничения
+KB_RELOAD_MAX_SHRINK = float(os.getenv("KB_RELOAD_MAX_SHRINK", 0.5))
+
+
+class IndexRejectedError(Exception):
+    """Пересобранный индекс подозрительно мал, живой снимок остаётся прежним"""
+
+
+@lru_cache(maxsize=1)
+def get_embedding_encoding():
+    """Токенизатор моделей text-embedding-3 (загружается один раз)"""
+    return tiktoken.get_encoding("cl100k_base")
+
+
+class KnowledgeIndex:
+    """
+    Неизменяемый снимок индекса базы знаний: документы, матрица эмбеддингов, векторный индекс и BM25.
+    Поиск берёт ссылку на снимок один раз, поэтому подмена индекса не задевает уже идущие запросы.
+    """
+
+    def __init__(self, documents: List[Document], embeddings: QuantizedVectors, vector_index, bm25, version: str,
+                 token_counts: Optional[np.ndarray] = None):
+        self.documents = documents
+        self.embeddings = embeddings
+        self.vector_index = vector_index
+        self.bm25 = bm25
+        self.version = version
+        # Число токенов в каждом чанке (cl100k_base), считается один раз при сборке или берётся из артефакта
+        self.token_counts = token_counts
+        self._rows: Optional[Dict[int, int]] = None
+
+    def chunk_token_counts(self, documents: List[Document]) -> List[Optional[int]]:
+        """Готовое число токенов для документов этого снимка; None - документ не из него (или счётчиков нет)"""
+        if self.token_counts is None:
+            return [None] * len(documents)
+        if self._rows is None:
+            self._rows = {id(doc): row for row, doc in enumerate(self.documents)}
+        rows = [self._rows.get(id(doc)) for doc in documents]
+        return [int(self.token_counts[row]) if row is not None else None for row in rows]
+
+    def bm25_scores(self, query: str) -> np.ndarray:
+        """Оценки BM25 запроса по всем документам"""
+        return self.bm25.get_scores(tokenize(query))
+
+    def vector_scores(self, query_embedding) -> np.ndarray:
+        """Косинусная близость эмбеддинга запроса ко всем документам"""
+        return self.vector_scores_batch([query_embedding])[0]
+
+    def vector_scores_batch(self, query_embeddings) -> np.ndarray:
+        """Косинусная близость нескольких запросов ко всем документам одним матричным умножением"""
+        queries = normalize_rows(query_embeddings)
+        if self.vector_index.exhaustive:
+            return self.vector_index.score_all(queries)
+
+        # Приближённый индекс отдаёт только кандидатов, остальным документам ставим худшую из их оценок
+        candidate_scores, candidate_ids = self.vector_index.search(queries, VECTOR_SEARCH_CANDIDATES)
+        scores = np.empty((len(queries), len(self.documents)), dtype=np.float32)
+        for row, (row_scores, row_ids) in enumerate(zip(candidate_scores, candidate_ids)):
+            found = row_ids >= 0
+            scores[row] = row_scores[found].min() if found.any() else 0
+            scores[row, row_ids[found]] = row_scores[found]
+        return scores
+
+    def rank_ids(self, strategy: FusionStrategy, bm25_scores: List[np.ndarray], query_embeddings,
+                 k: int, alpha: float) -> List[np.ndarray]:
+        """Номера top-k документов для каждого запроса"""
+        return strategy.rank_batch(self, bm25_scores, query_embeddings, k, alpha)
+
+    def rank_documents(self, strategy: FusionStrategy, bm25_scores: List[np.ndarray], query_embeddings,
+                       k: int, alpha: float) -> List[List[Document]]:
+        """Объединение BM25 и векторного поиска выбранной стратегией и выбор top-k документов"""
+        return [
+            [self.documents[i] for i in ids]
+            for ids in self.rank_ids(strategy, bm25_scores, query_embeddings, k, alpha)
+        ]
+
+    def retrieval_confidence(self, ids: np.ndarray, query_embedding, bm25_scores: np.ndarray) -> Dict[str, float]:
+        """
+        Статистики уверенности поиска по найденным документам: косинусная близость запроса (лучшая и средняя)
+        и лучшая оценка BM25. В отличие от слитых оценок, косинус сравним между запросами
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return {'top_cosine': 0.0, 'mean_cosine': 0.0, 'top_bm25': 0.0}
+        cosine = self.vector_index.exact_scores(ids, normalize_rows(query_embedding))
+        return {
+            'top_cosine': float(cosine.max()),
+            'mean_cosine': float(cosine.mean()),
+            'top_bm25': float(bm25_scores[ids].max()),
+        }
+
 
 class EmbeddingService:
     _instance = None
 
-    def __new__(cls, *args, **kwargs):
+    def __new__(cls, *args, use_artifact: bool = True, **kwargs):
         """Singleton pattern"""
         if not cls._instance:
             cls._instance = super(EmbeddingService, cls).__new__(cls, *args, **kwargs)
-            cls._instance._initialize_embeddings()
+            cls._instance._initialize_embeddings(use_artifact)
         return cls._instance
 
-    def _initialize_embeddings(self):
+    def _initialize_embeddings(self, use_artifact: bool = True):
         """Инициализация эмбеддингов при создании объекта"""
-        # Чтение данных из файла
-        text = self.read_data_from_file('data.txt')
+        self.embedding_store = EmbeddingStore()
+
+        # Кэш эмбеддингов запросов (повторяющиеся вопросы и переформулировки)
+        self.query_cache = QueryEmbeddingCache()
 
-        # Разделение текста на чанки с оверлапом
-        chunks = self.split_text_into_chunks(text, chunk_size=750, chunk_overlap=50)
+        # Способ объединения BM25 и векторного поиска (FUSION_STRATEGY)
+        self.fusion_strategy = create_fusion_strategy()
+
+        # Пересборка индекса идёт в фоне, одновременно - не больше одной
+        self._reload_lock = threading.Lock()
+        self._reload_thread: Optional[threading.Thread] = None
+
+        # Готовый артефакт (python -m RAG.build_index) только отображается в память;
+        # если его нет или база знаний с тех пор изменилась - индексируем исходные файлы
+        self.index = self.load_artifact() if use_artifact else None
+        if self.index is None:
+            self.index = self.build_index()
+
+        if KB_WATCH_INTERVAL > 0:
+            self.start_watcher(KB_WATCH_INTERVAL)
+
+    def build_index(self, previous: Optional[KnowledgeIndex] = None) -> KnowledgeIndex:
+        """
+        Собирает новый снимок индекса базы знаний (используется и при старте, и при горячей замене).
+        При замене previous проверяется до эмбеддинга, чтобы отвергнутый корпус не успел урезать хранилище.
+        """
+        # Чтение базы знаний (файл или каталог) и нарезка на чанки только изменившихся файлов
+        documents = IngestionPipeline(splitter=self.split_text_into_chunks).run()
+        if previous is not None:
+            self.check_replacement(previous, documents)
 
-        # Конвертируем строки в документы
-        self.documents = [Document(page_content=chunk) for chunk in chunks]
+        # Берём эмбеддинги из хранилища на диске, через API считаем только новые чанки.
+        # В памяти держим только нормализованную матрицу в EMBEDDING_DTYPE
+        embeddings = QuantizedVectors(self.load_or_build_embeddings(documents), EMBEDDING_DTYPE)
+        logger.info(f"Embedding matrix: {len(embeddings)} x {embeddings.shape[1] if len(embeddings) else 0} "
+                    f"{embeddings.dtype}, {embeddings.nbytes / 2 ** 20:.1f} MiB")
 
-        # Генерируем эмбеддинги для всех документов
-        self.embeddings = self.get_embeddings_for_documents(self.documents)
+        # Точная дооценка кандидатов читает полноточные векторы из хранилища через memory-map
+        hashes = [content_hash(doc.page_content) for doc in documents]
+        version = content_hash(EMBEDDING_MODEL + ''.join(hashes))
+        vector_index = self.open_vector_index(
+            embeddings, self.embedding_store.open_rows(EMBEDDING_MODEL, hashes), version
+        )
 
         # Создаем BM25 индекс
-        tokenized_documents = [doc.page_content.split() for doc in self.documents]
-        self.bm25 = BM25Okapi(tokenized_documents)
+        tokenized_documents = [tokenize(doc.page_content) for doc in documents]
+        bm25 = SparseBM25(tokenized_documents)
+
+        token_counts = self.count_tokens([doc.page_content for doc in documents])
+        return KnowledgeIndex(documents, embeddings, vector_index, bm25, version, token_counts=token_counts)
+
+    @staticmethod
+    def check_replacement(previous: KnowledgeIndex, documents: List[Document]):
+        """IndexRejectedError, если новый корпус пуст или меньше прежнего больше чем на KB_RELOAD_MAX_SHRINK"""
+        before, after = len(previous.documents), len(documents)
+        if after == 0:
+            raise IndexRejectedError(f"Rebuilt knowledge base index has no chunks, "
+                                     f"keeping index {previous.version[:12]} ({before} chunks)")
+        if before and (before - after) / before > KB_RELOAD_MAX_SHRINK:
+            raise IndexRejectedError(f"Rebuilt knowledge base index shrank from {before} to {after} chunks "
+                                     f"(more than KB_RELOAD_MAX_SHRINK={KB_RELOAD_MAX_SHRINK:g}), "
+                                     f"keeping index {previous.version[:12]}")
+
+    def open_vector_index(self, embeddings: QuantizedVectors, full_precision, version: str):
+        """Векторный индекс (VECTOR_INDEX=exact|ivfpq), привязанный к набору чанков и модели"""
+        vector_index = create_vector_index()
+        vector_index.set_full_precision(full_precision)
+        return vector_index.load_or_build(
+            embeddings, os.path.join(self.embedding_store.directory, VECTOR_INDEX_FILE), version
+        )
+
+    def save_artifact(self, path: str = KB_ARTIFACT_PATH, index: KnowledgeIndex = None) -> dict:
+        """
+        Сохраняет индекс в один файл-артефакт: заголовок (модель, параметры нарезки, хэши исходных файлов,
+        чанки, словарь BM25) и массивы (эмбеддинги, квантованные коды, число токенов, веса BM25).
+        Возвращает заголовок.
+        """
+        index = index or self.index
+        pipeline = IngestionPipeline(splitter=self.split_text_into_chunks)
+        hashes = [content_hash(doc.page_content) for doc in index.documents]
+        stored = self.embedding_store.open_rows(EMBEDDING_MODEL, hashes)
+        if stored is not None:
+            full_precision = normalize_rows(stored[np.arange(len(stored))])
+        else:
+            full_precision = normalize_rows(np.asarray(index.embeddings))
+
+        token_counts = index.token_counts
+        if token_counts is None:
+            token_counts = self.count_tokens([doc.page_content for doc in index.documents])
+        bm25_params, bm25_arrays = index.bm25.to_arrays()
+
+        header = {
+            'model': EMBEDDING_MODEL,
+            'dtype': index.embeddings.dtype.name,
+            'dim': int(full_precision.shape[1]) if full_precision.ndim == 2 else 0,
+            'version': index.version,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'chunk_size': pipeline.chunk_size,
+            'chunk_overlap': pipeline.chunk_overlap,
+            'sources': pipeline.file_hashes(),
+            'chunks': [{'text': doc.page_content, 'metadata': doc.metadata} for doc in index.documents],
+            'bm25': bm25_params,
+        }
+        arrays = {'embeddings': full_precision, 'token_counts': token_counts}
+        arrays.update({f'bm25_{name}': array for name, array in bm25_arrays.items()})
+        if index.embeddings.dtype != np.float32:
+            arrays['codes'] = index.embeddings.codes
+        if index.embeddings.scales is not None:
+            arrays['scales'] = index.embeddings.scales
+        write_artifact(path, header, arrays)
+        return header
+
+    def load_artifact(self, path: str = KB_ARTIFACT_PATH) -> Optional[KnowledgeIndex]:
+        """
+        Индекс из артефакта: массивы отображаются в память, ничего не пересчитывается.
+        None, если артефакта нет, он от другой модели или исходные файлы базы знаний изменились.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            header, arrays = read_artifact(path)
+            pipeline = IngestionPipeline(splitter=self.split_text_into_chunks)
+            if header['model'] != EMBEDDING_MODEL:
+                logger.info(f"Index artifact was built with {header['model']}, indexing sources for {EMBEDDING_MODEL}")
+                return None
+            if (header['sources'], header['chunk_size'], header['chunk_overlap']) != \
+                    (pipeline.file_hashes(), pipeline.chunk_size, pipeline.chunk_overlap):
+                logger.info("Knowledge base changed since the index artifact was built, indexing sources")
+                return None
+
+            documents = [Document(page_content=chunk['text'], metadata=chunk['metadata']) for chunk in header['chunks']]
+            full_precision = arrays['embeddings']
+            if header['dtype'] == EMBEDDING_DTYPE.name:
+                embeddings = QuantizedVectors.from_codes(arrays.get('codes', full_precision), arrays.get('scales'))
+            else:
+                embeddings = QuantizedVectors(full_precision, EMBEDDING_DTYPE)
+            bm25 = SparseBM25.from_arrays(header['bm25'], {
+                name[len('bm25_'):]: array for name, array in arrays.items() if name.startswith('bm25_')
+            })
+        except (OSError, ArtifactError, KeyError, ValueError) as e:
+            logger.warning(f"Index artifact at {path} is unusable ({e}), indexing sources")
+            return None
+
+        vector_index = self.open_vector_index(embeddings, full_precision, header['version'])
+        logger.info(f"Loaded index artifact {header['version'][:12]} built {header['created_at']}: "
+                    f"{len(documents)} chunks, {header['dtype']}")
+        return KnowledgeIndex(documents, embeddings, vector_index, bm25, header['version'],
+                              token_counts=arrays['token_counts'])
+
+    def reload_index(self) -> bool:
+        """
+        Пересобирает индекс и атомарно подменяет ссылку на живой снимок.
+        Возвращает False, если пересборка уже идёт; при ошибке или IndexRejectedError старый снимок остаётся.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            index = self.build_index(previous=self.index)
+            previous, self.index = self.index, index
+            logger.info(f"Knowledge base index swapped: {previous.version[:12]} -> {index.version[:12]}, "
+                        f"{len(index.documents)} chunks")
+            return True
+        finally:
+            self._reload_lock.release()
+
+    async def areload_index(self) -> bool:
+        """Пересборка индекса в executor, не блокируя event loop бота"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.reload_index)
+
+    def start_background_reload(self) -> bool:
+        """Запускает пересборку в фоновом потоке; False, если она уже идёт"""
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            return False
+        self._reload_thread = threading.Thread(target=self.reload_index, name='kb-reload', daemon=True)
+        self._reload_thread.start()
+        return True
+
+    def start_watcher(self, interval: float):
+        """Следит за файлами базы знаний и запускает горячую пересборку при их изменении"""
+        pipeline = IngestionPipeline()
+
+        def watch():
+            signature = pipeline.stat_signature()
+            while True:
+                time.sleep(interval)
+                current = pipeline.stat_signature()
+                if current == signature:
+                    continue
+                logger.info("Knowledge base files changed, rebuilding index")
+                try:
+                    if self.reload_index():
+                        signature = current
+                except IndexRejectedError as e:
+                    # Повторяем только после следующего изменения файлов, а не на каждой проверке
+                    signature = current
+                    logger.error(str(e))
+                except Exception as e:
+                    logger.error(f"Knowledge base reload failed: {str(e)}")
+
+        threading.Thread(target=watch, name='kb-watcher', daemon=True).start()
+
+    @property
+    def documents(self) -> List[Document]:
+        return self.index.documents
+
+    @property
+    def embeddings(self) -> QuantizedVectors:
+        return self.index.embeddings
+
+    @property
+    def vector_index(self):
+        return self.index.vector_index
+
+    @property
+    def bm25(self):
+        return self.index.bm25
 
     def read_data_from_file(self, filepath):
         """Чтение всего текста из файла"""
@@ -53,58 +379,190 @@ class EmbeddingService:
         )
         return text_splitter.split_text(text)
 
-    def get_openai_embedding(self, text, model="text-embedding-3-small"):
+    def count_tokens(self, texts: List[str]) -> np.ndarray:
+        """Число токенов cl100k_base в каждом тексте"""
+        encoding = get_embedding_encoding()
+        return np.array([len(encoding.encode(text)) for text in texts], dtype=np.int32)
+
+    def build_context(self, documents: List[Document], budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+        """
+        Контекст для промпта генерации: лучшие чанки в пределах бюджета токенов, без повторов оверлапа
+        и без метаданных (см. context_packing.pack_context). Токены берутся готовыми из снимка индекса,
+        считаются заново только для документов из уже подменённого снимка.
+        """
+        token_counts = self.index.chunk_token_counts(documents)
+        missing = [position for position, count in enumerate(token_counts) if count is None]
+        if missing:
+            counted = self.count_tokens([documents[position].page_content for position in missing])
+            for position, count in zip(missing, counted):
+                token_counts[position] = int(count)
+        return pack_context(documents, token_counts, budget)
+
+    @property
+    def client(self) -> openai.OpenAI:
+        """Общий клиент OpenAI: пул соединений переиспользуется всеми запросами"""
+        if getattr(self, '_client', None) is None:
+            self._client = openai.OpenAI()
+        return self._client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        """Общий асинхронный клиент OpenAI для запросов из event loop бота"""
+        if getattr(self, '_async_client', None) is None:
+            self._async_client = openai.AsyncOpenAI()
+        return self._async_client
+
+    def get_openai_embedding(self, text, model=EMBEDDING_MODEL):
         """Получение эмбеддингов через OpenAI API"""
-        client = openai.OpenAI()
-        response = client.embeddings.create(
+        response = self.client.embeddings.create(
+            input=text,
+            model=model
+        )
+        return response.data[0].embedding
+
+    async def aget_openai_embedding(self, text, model=EMBEDDING_MODEL):
+        """Асинхронное получение эмбеддинга через OpenAI API"""
+        response = await self.async_client.embeddings.create(
             input=text,
             model=model
         )
         return response.data[0].embedding
 
-    def get_embeddings_for_documents(self, documents: List[Document], model: str = "text-embedding-3-small") -> np.ndarray:
-        """Получаем эмбеддинги для всех документов"""
-        embeddings = []
-        for doc in documents:
-            embedding = self.get_openai_embedding(doc.page_content, model)
-            embeddings.append(embedding)
+    def embed_query(self, query: str, model: str = EMBEDDING_MODEL) -> np.ndarray:
+        """Эмбеддинг запроса (float32) с использованием кэша"""
+        embedding = self.query_cache.get(query, model)
+        if embedding is None:
+            embedding = np.asarray(self.get_openai_embedding(query, model), dtype=np.float32)
+            self.query_cache.put(query, model, embedding)
+        return embedding
+
+    async def aembed_query(self, query: str, model: str = EMBEDDING_MODEL) -> np.ndarray:
+        """Асинхронный эмбеддинг запроса (float32) с использованием кэша"""
+        embedding = self.query_cache.get(query, model)
+        if embedding is None:
+            embedding = np.asarray(await self.aget_openai_embedding(query, model), dtype=np.float32)
+            self.query_cache.put(query, model, embedding)
+        return embedding
+
+    def embed_queries(self, queries: List[str], model: str = EMBEDDING_MODEL) -> np.ndarray:
+        """Эмбеддинги нескольких запросов: промахи кэша считаются одним запросом к API"""
+        embeddings = [self.query_cache.get(query, model) for query in queries]
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fresh = self.embed_batch([queries[index] for index in missing], model)
+            for index, embedding in zip(missing, fresh):
+                self.query_cache.put(queries[index], model, embedding)
+                embeddings[index] = embedding
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def pack_embedding_batches(self, texts: List[str]) -> List[List[int]]:
+        """Раскладываем индексы текстов по батчам в пределах лимитов на число входов и токенов"""
+        encoding = get_embedding_encoding()
+        batches, batch, batch_tokens = [], [], 0
+        for index, text in enumerate(texts):
+            tokens = len(encoding.encode(text))
+            if batch and (len(batch) >= EMBEDDING_BATCH_MAX_INPUTS or batch_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(index)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @retry(
+        reraise=True,
+        retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)),
+        wait=wait_exponential(multiplier=1, max=30),
+        stop=stop_after_attempt(6)
+    )
+    def embed_batch(self, texts: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+        """Один запрос к API на батч; при ошибке повторяется только этот батч"""
+        response = self.client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def get_embeddings_for_documents(self, documents: List[Document], model: str = EMBEDDING_MODEL) -> np.ndarray:
+        """Получаем эмбеддинги для всех документов: батчами, несколько батчей параллельно"""
+        texts = [doc.page_content for doc in documents]
+        batches = self.pack_embedding_batches(texts)
+
+        embeddings = [None] * len(texts)
+        with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_CONCURRENCY) as pool:
+            results = pool.map(lambda batch: self.embed_batch([texts[i] for i in batch], model), batches)
+            for batch, batch_embeddings in zip(batches, results):
+                for index, embedding in zip(batch, batch_embeddings):
+                    embeddings[index] = embedding
         return np.array(embeddings)
 
+    def load_or_build_embeddings(self, documents: List[Document], model: str = EMBEDDING_MODEL) -> np.ndarray:
+        """Эмбеддинги документов с переиспользованием сохранённых по хэшу содержимого"""
+        hashes = [content_hash(doc.page_content) for doc in documents]
+        stored = self.embedding_store.load(model) or {}
+
+        missing = [doc for doc, chunk_hash in zip(documents, hashes) if chunk_hash not in stored]
+        vectors = dict(stored)
+        if missing:
+            logger.info(f"Embedding {len(missing)} of {len(documents)} chunks")
+            for doc, embedding in zip(missing, self.get_embeddings_for_documents(missing, model)):
+                vectors[content_hash(doc.page_content)] = embedding
+
+        embeddings = np.array([vectors[chunk_hash] for chunk_hash in hashes], dtype=np.float32)
+        # Сохраняем, если появились новые чанки или в хранилище остались удалённые;
+        # пустой корпус хранилище не затирает - его векторы понадобятся, когда источник вернётся
+        if hashes and (missing or set(stored) != set(hashes)):
+            self.embedding_store.save(model, hashes, embeddings)
+        return embeddings
+
     def fusion_retrieval(self, query: str, k: int = 28, alpha: float = 0.5) -> List[Document]:
         """
         Комбинированный поиск: семантический (по эмбеддингам) и по ключевым словам (BM25)
         """
+        index = self.index
 
         # Step 1: Perform BM25 search
-        tokenized_query = query.split()
-        bm25_scores = self.bm25.get_scores(tokenized_query)
+        bm25_scores = index.bm25_scores(query)
 
-        # Step 2: Perform vector search (semantic search using embeddings)
-        query_embedding = self.get_openai_embedding(query)
-        vector_scores = np.linalg.norm(self.embeddings - query_embedding, axis=1)
+        # Step 2: Perform vector search (semantic search using embeddings) and fuse the results
+        query_embedding = self.embed_query(query)
+        return index.rank_documents(self.fusion_strategy, [bm25_scores], [query_embedding], k, alpha)[0]
 
-        # Нормализуем векторные оценки
-        vector_scores = 1 - (vector_scores - np.min(vector_scores)) / (np.max(vector_scores) - np.min(vector_scores))
+    async def afusion_retrieval(self, query: str, k: int = 28, alpha: float = 0.5) -> List[Document]:
+        """
+        Асинхронный fusion_retrieval: эмбеддинг запроса идёт через асинхронный клиент,
+        BM25 считается в executor параллельно с сетевым запросом, event loop не блокируется
+        """
+        documents, _ = await self.afusion_retrieval_with_confidence(query, k, alpha)
+        return documents
 
-        # Нормализуем BM25 оценки
-        bm25_scores = (bm25_scores - np.min(bm25_scores)) / (np.max(bm25_scores) - np.min(bm25_scores))
+    async def afusion_retrieval_with_confidence(self, query: str, k: int = 28,
+                                                alpha: float = 0.5) -> Tuple[List[Document], Dict[str, float]]:
+        """afusion_retrieval вместе со статистиками уверенности поиска (KnowledgeIndex.retrieval_confidence)"""
+        index = self.index
+        loop = asyncio.get_running_loop()
+        bm25_future = loop.run_in_executor(None, index.bm25_scores, query)
+        try:
+            query_embedding = await self.aembed_query(query)
+        finally:
+            bm25_scores = await bm25_future
 
-        # Step 3: Combine the scores
-        combined_scores = alpha * vector_scores + (1 - alpha) * bm25_scores
+        def rank():
+            ids = index.rank_ids(self.fusion_strategy, [bm25_scores], [query_embedding], k, alpha)[0]
+            return [index.documents[i] for i in ids], index.retrieval_confidence(ids, query_embedding, bm25_scores)
 
-        # Step 4: Rank documents based on the combined scores
-        sorted_indices = np.argsort(combined_scores)[::-1]
+        return await loop.run_in_executor(None, rank)
 
-        # Step 5: Return the top k documents
-        x = [self.documents[i] for i in sorted_indices[:k]]
-        print(x)
-        return x
+    def fusion_retrieval_batch(self, queries: List[str], k: int = 28, alpha: float = 0.5) -> List[List[Document]]:
+        """Комбинированный поиск сразу для нескольких запросов: векторные оценки считаются одним умножением"""
+        index = self.index
+        query_embeddings = self.embed_queries(queries)
+        bm25_scores = [index.bm25_scores(query) for query in queries]
+        return index.rank_documents(self.fusion_strategy, bm25_scores, query_embeddings, k, alpha)
 
 
-# Пример использования:
+# Пример использования (замеры скорости и качества поиска - python -m RAG.benchmarks.retrieval):
 if __name__ == "__main__":
     embedding_service = EmbeddingService()  # Создаем или получаем уже созданный экземпляр
-    query = "What are the effects of climate change?"
+    query = "Сколько стоит открыть магазин Жизньмарт?"
 
     # Выполняем поиск
     top_docs = embedding_service.fusion_retrieval(query, k=5, alpha=0.5)
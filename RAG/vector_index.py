@@ -0,0 +1,384 @@
+import json
+import logging
+import os
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Бэкенд векторного поиска: exact (полный перебор) или ivfpq (приближённый)
+VECTOR_INDEX = os.environ.get('VECTOR_INDEX', 'exact')
+
+# Параметры IVF-PQ: число кластеров (0 - 4*sqrt(N)), сколько кластеров просматривать,
+# число подпространств PQ и сколько кандидатов дооценивать точно
+IVF_NLIST = int(os.environ.get('IVF_NLIST', 0))
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', 8))
+PQ_M = int(os.environ.get('PQ_M', 16))
+IVF_RERANK = int(os.environ.get('IVF_RERANK', 64))
+IVF_TRAIN_SIZE = int(os.environ.get('IVF_TRAIN_SIZE', 100000))
+
+# Сколько строк матрицы переводим в float32 за один шаг при скоринге
+SCORING_BLOCK_ROWS = int(os.environ.get('SCORING_BLOCK_ROWS', 2048))
+
+# Сколько лучших кандидатов точного поиска по квантованной матрице пересчитывать в полной точности (0 - не пересчитывать)
+QUANTIZED_RERANK = int(os.environ.get('QUANTIZED_RERANK', 0))
+
+INDEX_FORMAT_VERSION = 1
+VECTOR_INDEX_FILE = 'vector_index.npz'
+
+
+def normalize_rows(vectors, dtype=np.float32) -> np.ndarray:
+    """L2-нормализация векторов (по последней оси), чтобы косинус считался одним скалярным произведением"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(dtype, copy=False)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k лучших оценок по убыванию: argpartition, затем сортируются только победители"""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < scores.shape[-1] else np.arange(scores.shape[-1])
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class QuantizedVectors:
+    """
+    Нормализованные векторы в float32, float16 или int8 с масштабом на вектор (x ≈ scale * codes).
+    Матрица не восстанавливается: q·x ≈ scale * (q·codes), масштаб применяется к готовым оценкам.
+    """
+    SUPPORTED_DTYPES = (np.dtype(np.float32), np.dtype(np.float16), np.dtype(np.int8))
+
+    def __init__(self, vectors, dtype=np.float32, block_rows: int = SCORING_BLOCK_ROWS):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in self.SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype '{self.dtype}', expected float32, float16 or int8")
+        self.block_rows = block_rows
+        vectors = normalize_rows(vectors)
+        self.scales: Optional[np.ndarray] = None
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self.codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        else:
+            self.codes = vectors.astype(self.dtype, copy=False)
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray, scales: Optional[np.ndarray] = None,
+                   block_rows: int = SCORING_BLOCK_ROWS) -> 'QuantizedVectors':
+        """Векторы из готовых кодов (например, отображённых в память из артефакта) без копирования"""
+        vectors = cls.__new__(cls)
+        vectors.dtype = codes.dtype
+        vectors.block_rows = block_rows
+        vectors.codes = codes
+        vectors.scales = scales
+        return vectors
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __array__(self, dtype=None, copy=None):
+        """Восстановленная float32-матрица (только для построения индексов)"""
+        vectors = self.codes.astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[:, None]
+        return vectors if dtype is None else vectors.astype(dtype, copy=False)
+
+    def dot(self, queries: np.ndarray) -> np.ndarray:
+        """Оценки всех векторов для нормализованных запросов"""
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.dtype == np.float32:
+            return queries @ self.codes.T
+        # float16/int8 BLAS не умножает, поэтому коды переводим в float32 блоками
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), self.block_rows):
+            block = self.codes[start:start + self.block_rows].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def dot_rows(self, ids: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Оценки выбранных строк для одного запроса"""
+        scores = self.codes[ids].astype(np.float32) @ np.asarray(query, dtype=np.float32)
+        if self.scales is not None:
+            scores *= self.scales[ids]
+        return scores
+
+
+def assign_clusters(data: np.ndarray, centroids: np.ndarray, block_rows: int = SCORING_BLOCK_ROWS) -> np.ndarray:
+    """Номер ближайшего (по L2) центроида для каждой строки"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), block_rows):
+        block = data[start:start + block_rows]
+        # ||x||^2 одинаков для всех центроидов, поэтому его можно не считать
+        assignment[start:start + len(block)] = (centroid_norms - 2 * block @ centroids.T).argmin(axis=1)
+    return assignment
+
+
+def kmeans(data: np.ndarray, n_clusters: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Алгоритм Ллойда на NumPy; пустые кластеры переинициализируются случайными точками"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(data))
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = assign_clusters(data, centroids)
+        one_hot = sparse.csr_matrix(
+            (np.ones(len(data), dtype=np.float32), (assignment, np.arange(len(data)))),
+            shape=(n_clusters, len(data))
+        )
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = one_hot @ data
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if not filled.all():
+            centroids[~filled] = data[rng.choice(len(data), int((~filled).sum()))]
+    return centroids
+
+
+class VectorIndex:
+    """
+    Интерфейс векторного индекса. Векторы и запросы L2-нормализованы, оценка - косинусная близость.
+    """
+    name = 'base'
+    # True, если индекс умеет дёшево оценить весь корпус (score_all)
+    exhaustive = False
+    vectors: Optional[QuantizedVectors] = None
+    # Полноточные векторы в порядке строк индекса (например, memory-map хранилища эмбеддингов)
+    full_precision = None
+
+    def build(self, vectors: np.ndarray):
+        """Строит индекс по матрице векторов"""
+        raise NotImplementedError
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k для каждого запроса: (оценки, индексы строк); недостающие места заполняются -inf / -1"""
+        raise NotImplementedError
+
+    def score_all(self, queries: np.ndarray) -> np.ndarray:
+        """Оценки всех векторов корпуса (только для exhaustive-индексов)"""
+        raise NotImplementedError
+
+    def save(self, path: str, fingerprint: str):
+        """Сохраняет индекс на диск"""
+
+    def load(self, path: str, fingerprint: str, vectors: np.ndarray) -> bool:
+        """Загружает индекс, если он построен для того же корпуса и с теми же параметрами"""
+        return False
+
+    def set_full_precision(self, rows):
+        """Источник полноточных векторов для точной дооценки кандидатов"""
+        self.full_precision = rows
+
+    def exact_scores(self, ids: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Оценки кандидатов в наилучшей доступной точности"""
+        if self.full_precision is not None:
+            return normalize_rows(self.full_precision[ids]) @ query
+        return self.vectors.dot_rows(ids, query)
+
+    def load_or_build(self, vectors: np.ndarray, path: str, fingerprint: str) -> 'VectorIndex':
+        """Поднимает индекс с диска или строит заново и сохраняет"""
+        if not self.load(path, fingerprint, vectors):
+            self.build(vectors)
+            self.save(path, fingerprint)
+        return self
+
+
+def as_quantized(vectors: Union[np.ndarray, QuantizedVectors]) -> QuantizedVectors:
+    """Оборачивает обычную матрицу, уже квантованные векторы возвращает как есть"""
+    if isinstance(vectors, QuantizedVectors):
+        return vectors
+    return QuantizedVectors(vectors, np.float16 if np.asarray(vectors).dtype == np.float16 else np.float32)
+
+
+class ExactIndex(VectorIndex):
+    """
+    Точный поиск полным перебором (одно матричное умножение) по float32/float16/int8 матрице.
+    Для квантованной матрицы rerank лучших кандидатов можно пересчитать в полной точности.
+    """
+    name = 'exact'
+    exhaustive = True
+
+    def __init__(self, block_rows: int = SCORING_BLOCK_ROWS, rerank: int = QUANTIZED_RERANK):
+        self.block_rows = block_rows
+        self.rerank = rerank
+
+    def build(self, vectors: np.ndarray):
+        self.vectors = as_quantized(vectors)
+
+    def score_all(self, queries: np.ndarray) -> np.ndarray:
+        return self.vectors.dot(queries)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.score_all(queries)
+        if self.rerank <= 0 or self.full_precision is None or self.vectors.dtype == np.float32:
+            ids = np.stack([top_k_indices(row, k) for row in scores])
+            return np.take_along_axis(scores, ids, axis=1), ids
+
+        queries = normalize_rows(queries)
+        all_scores, all_ids = [], []
+        for query, row in zip(queries, scores):
+            shortlist = top_k_indices(row, max(k, self.rerank))
+            exact = self.exact_scores(shortlist, query)
+            best = top_k_indices(exact, k)
+            all_ids.append(shortlist[best])
+            all_scores.append(exact[best])
+        return np.stack(all_scores), np.stack(all_ids)
+
+
+class IVFPQIndex(VectorIndex):
+    """
+    Приближённый поиск IVF-PQ: векторы разбиты на nlist кластеров (k-means), остаток от центроида
+    сжат product quantization (m байт на вектор). Запрос просматривает nprobe ближайших кластеров,
+    оценивает кандидатов по таблицам скалярных произведений и при наличии полных векторов
+    пересчитывает rerank лучших точно. nprobe и rerank - компромисс между recall и задержкой.
+    """
+    name = 'ivfpq'
+
+    def __init__(self, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE, m: int = PQ_M,
+                 rerank: int = IVF_RERANK, train_size: int = IVF_TRAIN_SIZE, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.m = m
+        self.rerank = rerank
+        self.train_size = train_size
+        self.seed = seed
+
+    def _subspaces(self, dim: int) -> int:
+        """Наибольшее число подпространств <= m, на которое делится размерность"""
+        return next(m for m in range(min(self.m, dim), 0, -1) if dim % m == 0)
+
+    def build(self, vectors: np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        data = np.asarray(vectors, dtype=np.float32)
+        n, dim = data.shape
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        m = self._subspaces(dim)
+        sub_dim = dim // m
+
+        train = data[rng.choice(n, min(n, self.train_size), replace=False)]
+        self.centroids = kmeans(train, nlist, seed=self.seed)
+        # Для кодовых книг PQ (256 слов на подпространство) хватает ~40 точек на слово
+        pq_train = train[:256 * 40]
+        train_residuals = pq_train - self.centroids[assign_clusters(pq_train, self.centroids)]
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(train_residuals[:, j * sub_dim:(j + 1) * sub_dim]), 256, seed=self.seed)
+            for j in range(m)
+        ])
+
+        assignment = assign_clusters(data, self.centroids)
+        residuals = data - self.centroids[assignment]
+        codes = np.stack([
+            assign_clusters(np.ascontiguousarray(residuals[:, j * sub_dim:(j + 1) * sub_dim]), self.codebooks[j])
+            for j in range(m)
+        ], axis=1).astype(np.uint8)
+
+        # Инвертированные списки: строки отсортированы по кластеру, offsets - границы списков
+        order = np.argsort(assignment, kind='stable')
+        self.ids = order
+        self.codes = codes[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(self.centroids)))])
+        self.vectors = as_quantized(vectors)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32)
+        m, ksub, sub_dim = self.codebooks.shape
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+        for row, query in enumerate(queries):
+            coarse = self.centroids @ query
+            probe = top_k_indices(coarse, self.nprobe)
+            sizes = self.offsets[probe + 1] - self.offsets[probe]
+            if sizes.sum() == 0:
+                continue
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+
+            # q·x ≈ q·centroid + Σ_j q_j·codeword_j, таблица q_j·codeword считается один раз на запрос
+            lookup = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(m, sub_dim))
+            approx = np.repeat(coarse[probe], sizes) + lookup[np.arange(m), self.codes[rows]].sum(axis=1)
+
+            if self.vectors is not None and self.rerank > 0:
+                shortlist = top_k_indices(approx, max(k, self.rerank))
+                ids = self.ids[rows[shortlist]]
+                exact = self.exact_scores(ids, query)
+                best = top_k_indices(exact, k)
+                ids, scores = ids[best], exact[best]
+            else:
+                best = top_k_indices(approx, k)
+                ids, scores = self.ids[rows[best]], approx[best]
+            all_ids[row, :len(ids)] = ids
+            all_scores[row, :len(scores)] = scores
+        return all_scores, all_ids
+
+    def _meta(self, fingerprint: str) -> dict:
+        return {
+            'format_version': INDEX_FORMAT_VERSION,
+            'fingerprint': fingerprint,
+            'nlist': self.nlist,
+            'm': self.m,
+            'seed': self.seed,
+        }
+
+    def save(self, path: str, fingerprint: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(
+                file,
+                meta=np.array(json.dumps(self._meta(fingerprint))),
+                centroids=self.centroids,
+                codebooks=self.codebooks,
+                codes=self.codes,
+                ids=self.ids,
+                offsets=self.offsets,
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, fingerprint: str, vectors: np.ndarray) -> bool:
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                if json.loads(str(data['meta'])) != self._meta(fingerprint):
+                    logger.info("IVF-PQ index is stale, rebuilding")
+                    return False
+                self.centroids = data['centroids']
+                self.codebooks = data['codebooks']
+                self.codes = data['codes']
+                self.ids = data['ids']
+                self.offsets = data['offsets']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"IVF-PQ index at {path} is unreadable ({e}), rebuilding")
+            return False
+        self.vectors = as_quantized(vectors)
+        return True
+
+
+VECTOR_INDEXES = {
+    ExactIndex.name: ExactIndex,
+    IVFPQIndex.name: IVFPQIndex,
+}
+
+
+def create_vector_index(name: str = VECTOR_INDEX, **params) -> VectorIndex:
+    """Создаёт бэкенд векторного индекса по имени"""
+    if name not in VECTOR_INDEXES:
+        raise ValueError(f"Unknown vector index '{name}', expected one of {', '.join(VECTOR_INDEXES)}")
+    return VECTOR_INDEXES[name](**params)
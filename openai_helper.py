@@ -137,6 +137,16 @@ class OpenAIHelper:
             self.reset_chat_history(chat_id)
         return len(self.conversations[chat_id]), self.__count_tokens(self.conversations[chat_id])
 
+    def has_history(self, chat_id: int) -> bool:
+        """
+        Checks whether the next request of the chat is sent together with earlier messages.
+        :param chat_id: The chat ID
+        :return: True if the conversation holds messages besides the system prompt and has not expired
+        """
+        if len(self.conversations.get(chat_id, [])) <= 1:
+            return False
+        return not self.__max_age_reached(chat_id)
+
     async def get_chat_response(self, chat_id: int, query: str) -> tuple[str, str]:
         """
         Gets a full response from the GPT model.
@@ -220,17 +230,52 @@ class OpenAIHelper:
 
         yield answer, tokens_used
 
+    async def get_chat_response_with_context(self, chat_id: int, prompt: str) -> tuple[str, int]:
+        """
+        Gets a full response to a prompt that carries retrieved context for the current request only.
+        The prompt is sent after the conversation history but is not stored in it; the caller adds
+        the user's question and the final answer with add_to_history.
+        :param chat_id: The chat ID
+        :param prompt: The prompt with instructions, the question and the retrieved context
+        :return: The answer from the model and the number of tokens used
+        """
+        response = await self.__common_get_chat_response(chat_id, prompt, persist_query=False)
+        return response.choices[0].message.content.strip(), response.usage.total_tokens
+
+    async def get_chat_response_with_context_stream(self, chat_id: int, prompt: str):
+        """
+        Stream a response to a prompt that carries retrieved context for the current request only.
+        :param chat_id: The chat ID
+        :param prompt: The prompt with instructions, the question and the retrieved context
+        :return: The answer so far and 'not_finished', then the full answer and the number of tokens used
+        """
+        response = await self.__common_get_chat_response(chat_id, prompt, stream=True, persist_query=False)
+        answer = ''
+        async for chunk in response:
+            if len(chunk.choices) == 0:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                answer += delta.content
+                yield answer, 'not_finished'
+        answer = answer.strip()
+        messages = self.conversations[chat_id] + [{"role": "user", "content": prompt},
+                                                  {"role": "assistant", "content": answer}]
+        yield answer, str(self.__count_tokens(messages))
+
     @retry(
         reraise=True,
         retry=retry_if_exception_type(openai.RateLimitError),
         wait=wait_fixed(20),
         stop=stop_after_attempt(10)
     )
-    async def __common_get_chat_response(self, chat_id: int, query: str, stream=False):
+    async def __common_get_chat_response(self, chat_id: int, query: str, stream=False, persist_query=True):
         """
         Request a response from the GPT model.
         :param chat_id: The chat ID
         :param query: The query to send to the model
+        :param persist_query: Whether to store the query in the conversation history; when False it is sent
+                              with this request only and functions are not offered
         :return: The answer from the model and the number of tokens used
         """
         bot_language = self.config['bot_language']
@@ -240,17 +285,22 @@ class OpenAIHelper:
 
             self.last_updated[chat_id] = datetime.datetime.now()
 
-            self.add_to_history(chat_id, role="user", content=query)
+            query_message = {"role": "user", "content": query}
+            if persist_query:
+                self.add_to_history(chat_id, role="user", content=query)
+                history = self.conversations[chat_id][1:-1]
+            else:
+                history = self.conversations[chat_id][1:]
 
             # Summarize the chat history if it's too long to avoid excessive token usage
-            token_count = self.__count_tokens(self.conversations[chat_id])
+            token_count = self.__count_tokens(self.conversations[chat_id] + ([] if persist_query else [query_message]))
             exceeded_max_tokens = token_count + self.config['max_tokens'] > self.__max_model_tokens()
             exceeded_max_history_size = len(self.conversations[chat_id]) > self.config['max_history_size']
 
             if exceeded_max_tokens or exceeded_max_history_size:
                 logging.info(f'Chat history for chat ID {chat_id} is too long. Summarising...')
                 try:
-                    summary = await self.__summarise(self.conversations[chat_id][1:-1])
+                    summary = await self.__summarise(history)
                     logging.debug(f'Summary: {summary}')
                     self.reset_chat_history(chat_id, summary)
                     # self.add_to_history(chat_id, role="assistant", content=summary)
@@ -261,16 +311,16 @@ class OpenAIHelper:
 
             common_args = {
                 'model': self.config['model'],
-                'messages': self.conversations[chat_id],
+                'messages': self.conversations[chat_id] + ([] if persist_query else [query_message]),
                 'temperature': self.config['temperature'],
-                'n': self.config['n_choices'],
+                'n': self.config['n_choices'] if persist_query else 1,
                 'max_tokens': self.config['max_tokens'],
                 'presence_penalty': self.config['presence_penalty'],
                 'frequency_penalty': self.config['frequency_penalty'],
                 'stream': stream
             }
 
-            if self.config['enable_functions']:
+            if self.config['enable_functions'] and persist_query:
                 functions = self.plugin_manager.get_functions_specs()
                 # print('functions:', functions)
                 if len(functions) > 0:
@@ -19,9 +19,11 @@ from PIL import Image
 
 from graph_state import GraphState
 
-from RAG.building_and_running_graph import run_graph
+from RAG.building_and_running_graph import run_graph, graph_registry
+from RAG.graph_metrics import graph_metrics
+from RAG.graph_ai import embedding_service
 from utils import is_group_chat, get_thread_id, message_text, wrap_with_indicator, split_into_chunks, \
-    edit_message_with_retry, get_stream_cutoff_values, is_allowed, is_within_budget, \
+    edit_message_with_retry, get_stream_cutoff_values, is_allowed, is_admin, is_within_budget, \
     get_reply_to_message_id, add_chat_request_to_usage_tracker, error_handler, is_direct_result, handle_direct_result, \
     cleanup_intermediate_files, start_text
 from openai_helper import OpenAIHelper, localized_text
@@ -251,6 +253,54 @@ class ChatGPTTelegramBot:
             text=localized_text('reset_done', self.config['bot_language'])
         )
 
+    async def reload_knowledge_base(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Rebuilds the knowledge base index in the background and swaps it in without a restart (admins only).
+        """
+        if not is_admin(self.config, update.message.from_user.id):
+            logging.warning(f'User {update.message.from_user.name} (id: {update.message.from_user.id}) '
+                            'is not allowed to reload the knowledge base')
+            await self.send_disallowed_message(update, context)
+            return
+
+        logging.info(f'Reloading the knowledge base, requested by {update.message.from_user.name} '
+                     f'(id: {update.message.from_user.id})...')
+        bot_language = self.config['bot_language']
+        await update.effective_message.reply_text(
+            message_thread_id=get_thread_id(update),
+            text=localized_text('reload_kb_started', bot_language)
+        )
+
+        try:
+            reloaded = await embedding_service.areload_index()
+            text = localized_text('reload_kb_done' if reloaded else 'reload_kb_in_progress', bot_language)
+        except Exception as e:
+            logging.exception(e)
+            text = f"{localized_text('reload_kb_failed', bot_language)}: {str(e)}"
+
+        await update.effective_message.reply_text(
+            message_thread_id=get_thread_id(update),
+            text=text
+        )
+
+    async def rag_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Shows p50/p95 latency, LLM calls and tokens per RAG graph node since start,
+        and the hit rates of the RAG caches (admins only).
+        """
+        if not is_admin(self.config, update.message.from_user.id):
+            logging.warning(f'User {update.message.from_user.name} (id: {update.message.from_user.id}) '
+                            'is not allowed to view RAG statistics')
+            await self.send_disallowed_message(update, context)
+            return
+
+        summary = graph_metrics.summary() or localized_text('rag_stats_empty', self.config['bot_language'])
+        for chunk in split_into_chunks(summary):
+            await update.effective_message.reply_text(
+                message_thread_id=get_thread_id(update),
+                text=chunk
+            )
+
     async def image(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Generates an image for the given prompt using DALL·E APIs
@@ -457,7 +507,7 @@ class ChatGPTTelegramBot:
 
                 else:
                     # Передаём состояние в run_graph и обновляем его
-                    response, total_tokens = await run_graph(state)
+                    response, total_tokens = await run_graph(state.openai_helper, state.chat_id, state.question)
 
                     self.usage[user_id].add_chat_tokens(total_tokens, self.config['token_price'])
                     if str(user_id) not in allowed_user_ids and 'guests' in self.usage:
@@ -723,10 +773,52 @@ class ChatGPTTelegramBot:
                 )
 
                 nonlocal total_tokens
+                sent_message = None
+                prev = ''
+                backoff = 0
+
+                async def _on_draft(content):
+                    # Черновик показывается пользователю, пока граф проверяет ответ; окончательный ответ
+                    # (или повторная генерация, или извинение) заменяет его после завершения графа
+                    nonlocal sent_message, prev, backoff
+                    content = split_into_chunks(content)[0]
+                    if len(content.strip()) == 0:
+                        return
+                    if sent_message is None:
+                        try:
+                            sent_message = await update.effective_message.reply_text(
+                                message_thread_id=get_thread_id(update),
+                                reply_to_message_id=get_reply_to_message_id(self.config, update),
+                                text=content
+                            )
+                            prev = content
+                        except Exception:
+                            pass
+                        return
+
+                    cutoff = get_stream_cutoff_values(update, content) + backoff
+                    if abs(len(content) - len(prev)) <= cutoff:
+                        return
+                    prev = content
+                    try:
+                        await edit_message_with_retry(context, chat_id, str(sent_message.message_id),
+                                                      text=content, markdown=False)
+                    except RetryAfter as e:
+                        backoff += 5
+                        await asyncio.sleep(e.retry_after)
+                    except TimedOut:
+                        backoff += 5
+                        await asyncio.sleep(0.5)
+                    except Exception:
+                        backoff += 5
+
                 # Передаём состояние в run_graph и обновляем его
                 try:
                     logger.info(f"Starting RAG workflow for chat_id {state.chat_id}")
-                    response, total_tokens = await run_graph(state.openai_helper, state.chat_id, state.question)
+                    response, total_tokens = await run_graph(
+                        state.openai_helper, state.chat_id, state.question,
+                        on_draft=_on_draft if self.config['stream'] else None
+                    )
                     logger.info(f"RAG workflow completed successfully for chat_id {state.chat_id}")
                 except Exception as e:
                     logger.error(f"Error in RAG workflow for chat_id {state.chat_id}: {str(e)}")
@@ -751,11 +843,21 @@ class ChatGPTTelegramBot:
                 # Split into chunks of 4096 characters (Telegram's message limit)
                 chunks = split_into_chunks(response)
 
+                # The streamed draft message receives the first chunk of the final answer
+                if sent_message is not None:
+                    try:
+                        await edit_message_with_retry(context, chat_id, str(sent_message.message_id), text=chunks[0])
+                        chunks = chunks[1:]
+                    except Exception:
+                        sent_message = None
+
                 for index, chunk in enumerate(chunks):
+                    reply_to_message_id = get_reply_to_message_id(self.config, update) \
+                        if index == 0 and sent_message is None else None
                     try:
                         await update.effective_message.reply_text(
                             message_thread_id=get_thread_id(update),
-                            reply_to_message_id=get_reply_to_message_id(self.config, update) if index == 0 else None,
+                            reply_to_message_id=reply_to_message_id,
                             text=chunk,
                             parse_mode=constants.ParseMode.MARKDOWN
                         )
@@ -763,8 +865,7 @@ class ChatGPTTelegramBot:
                         try:
                             await update.effective_message.reply_text(
                                 message_thread_id=get_thread_id(update),
-                                reply_to_message_id=get_reply_to_message_id(self.config,
-                                                                            update) if index == 0 else None,
+                                reply_to_message_id=reply_to_message_id,
                                 text=chunk
                             )
                         except Exception as exception:
@@ -1199,6 +1300,8 @@ class ChatGPTTelegramBot:
             .build()
 
         application.add_handler(CommandHandler('reset', self.reset))
+        application.add_handler(CommandHandler('reload_kb', self.reload_knowledge_base))
+        application.add_handler(CommandHandler('rag_stats', self.rag_stats))
         # application.add_handler(CommandHandler('help', self.help))
         # application.add_handler(CommandHandler('image', self.image))
         # application.add_handler(CommandHandler('tts', self.tts))
@@ -1223,4 +1326,7 @@ class ChatGPTTelegramBot:
 
         application.add_error_handler(error_handler)
 
+        # Компилируем RAG-граф заранее, чтобы первый запрос не платил за сборку
+        graph_registry.warm_up()
+
         application.run_polling()